@@ -1,23 +1,120 @@
-from flask import Flask, request, jsonify, session
+from flask import Flask, Response, request, jsonify, session, stream_with_context
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
 from models import db, User, TodoList, TodoItem
+from tree import (
+    fetch_list_items, build_tree, serialize_flat, create_item as create_tree_item,
+    set_text, move_subtree, complete_subtree, delete_subtree, check_counts
+)
+from changes import changes_since, purge_list
+from cache import tree_cache
+from migrations import migrate
+import database
+from batch import Batch, BatchError, MAX_OPERATIONS
+from hashing import hasher, HasherBusy
+from throttle import Throttle
+from transfer import export_lines, spool_import, import_spooled, iter_lines, ImportFailed
+from metrics import metrics
+from events import broker, TooManyStreams
+from search import search_items, MAX_SEARCH_RESULTS
+from sqlalchemy import select
+from werkzeug.middleware.proxy_fix import ProxyFix
 from functools import wraps
+import click
 import os
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev_key_for_development')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///todo.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///todo.db')
+app.config['SQLITE_BUSY_TIMEOUT'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+app.config['AUTO_MIGRATE'] = os.environ.get('AUTO_MIGRATE', '1') == '1'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SESSION_COOKIE_SECURE'] = True  # Ensure cookies are only sent over HTTPS
 app.config['SESSION_COOKIE_HTTPONLY'] = True  # Prevent JavaScript access to session cookie
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'  # Protect against CSRF
+app.config['TREE_CACHE_MAX_BYTES'] = int(os.environ.get('TREE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 16))
+app.config['AUTH_ATTEMPTS_PER_USERNAME'] = int(os.environ.get('AUTH_ATTEMPTS_PER_USERNAME', 10))
+app.config['AUTH_ATTEMPTS_PER_IP'] = int(os.environ.get('AUTH_ATTEMPTS_PER_IP', 30))
+app.config['AUTH_ATTEMPTS_WINDOW'] = int(os.environ.get('AUTH_ATTEMPTS_WINDOW', 60))
+app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 100))
+app.config['SERVER_TIMING'] = os.environ.get('SERVER_TIMING', '0') == '1'
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+app.config['SSE_MAX_CONNECTIONS_PER_USER'] = int(os.environ.get('SSE_MAX_CONNECTIONS_PER_USER', 5))
+app.config['SSE_MAX_CONNECTIONS'] = int(os.environ.get('SSE_MAX_CONNECTIONS', 100))
+app.config['SSE_HEARTBEAT_SECONDS'] = float(os.environ.get('SSE_HEARTBEAT_SECONDS', 15))
+
+# Behind a reverse proxy every request comes from the proxy's address, so the
+# client address for the per-IP auth throttle is taken from X-Forwarded-For,
+# trusting only as many hops as there are proxies
+if app.config['TRUSTED_PROXIES']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'],
+                            x_proto=app.config['TRUSTED_PROXIES'])
 
 CORS(app, supports_credentials=True)
 db.init_app(app)
+tree_cache.max_bytes = app.config['TREE_CACHE_MAX_BYTES']
+database.busy_timeout = app.config['SQLITE_BUSY_TIMEOUT']
+hasher.method = app.config['PASSWORD_HASH_METHOD']
+hasher.workers = app.config['PASSWORD_HASH_WORKERS']
+hasher.max_pending = app.config['PASSWORD_HASH_MAX_PENDING']
+metrics.slow_query_ms = app.config['SLOW_QUERY_MS']
+metrics.server_timing = app.config['SERVER_TIMING']
+broker.max_per_user = app.config['SSE_MAX_CONNECTIONS_PER_USER']
+broker.max_streams = app.config['SSE_MAX_CONNECTIONS']
+broker.heartbeat = app.config['SSE_HEARTBEAT_SECONDS']
 
 with app.app_context():
-    db.create_all()
+    metrics.init_app(app, db.engine)
+
+@metrics.collector
+def tree_cache_metrics():
+    stats = tree_cache.stats()
+    return [
+        ('todo_tree_cache_hits_total', 'counter', 'Tree cache hits', stats['hits']),
+        ('todo_tree_cache_misses_total', 'counter', 'Tree cache misses', stats['misses']),
+        ('todo_tree_cache_evictions_total', 'counter', 'Tree cache evictions', stats['evictions']),
+        ('todo_tree_cache_entries', 'gauge', 'Trees in the tree cache', stats['entries']),
+        ('todo_tree_cache_bytes', 'gauge', 'Size of the cached trees', stats['bytes'])
+    ]
+
+@metrics.collector
+def event_stream_metrics():
+    stats = broker.stats()
+    return [
+        ('todo_event_streams', 'gauge', 'Open list event streams', stats['streams']),
+        ('todo_event_stream_lists', 'gauge', 'Lists with open event streams', stats['lists'])
+    ]
+
+# Login and registration attempts are throttled before any password hashing
+username_throttle = Throttle(app.config['AUTH_ATTEMPTS_PER_USERNAME'], app.config['AUTH_ATTEMPTS_WINDOW'])
+ip_throttle = Throttle(app.config['AUTH_ATTEMPTS_PER_IP'], app.config['AUTH_ATTEMPTS_WINDOW'])
+
+# Bring the database schema up to date, creating it on first run
+if app.config['AUTO_MIGRATE']:
+    with app.app_context():
+        migrate()
+
+@app.cli.command('migrate')
+def migrate_command():
+    for version, description in migrate():
+        print(f'Applied migration {version}: {description}')
+
+@app.cli.command('check-counts')
+@click.option('--repair', is_flag=True, help='Overwrite the wrong counters with the recomputed ones.')
+def check_counts_command(repair):
+    wrong_items, wrong_lists = check_counts(repair)
+    for list_id, (total, completed) in sorted(wrong_lists.items()):
+        print(f'List {list_id}: should be {completed}/{total}')
+    for item_id, (total, completed) in sorted(wrong_items.items()):
+        print(f'Item {item_id}: should be {completed}/{total}')
+    print(f'{len(wrong_lists)} lists and {len(wrong_items)} items with wrong progress counters')
+    
+    if repair:
+        db.session.commit()
+        print('Repaired')
 
 def login_required(f):
     @wraps(f)
@@ -27,6 +124,23 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def throttle_auth(username):
+    retry_after = ip_throttle.hit(request.remote_addr)
+    if username:
+        retry_after = max(retry_after, username_throttle.hit(username))
+    
+    if not retry_after:
+        return None
+    
+    response = jsonify({'message': 'Too many attempts, please try again later'})
+    response.headers['Retry-After'] = str(int(retry_after) + 1)
+    return response, 429
+
+def hasher_busy():
+    response = jsonify({'message': 'Server is busy, please try again'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 @app.route('/api/register', methods=['POST'])
 def register():
     data = request.get_json()
@@ -36,10 +150,19 @@ def register():
     if not username or not password:
         return jsonify({'message': 'Username and password are required'}), 400
     
+    throttled = throttle_auth(username)
+    if throttled:
+        return throttled
+    
     if User.query.filter_by(username=username).first():
         return jsonify({'message': 'Username already exists'}), 400
     
-    user = User(username=username, password=generate_password_hash(password))
+    try:
+        pwhash = hasher.hash(password)
+    except HasherBusy:
+        return hasher_busy()
+    
+    user = User(username=username, password=pwhash)
     db.session.add(user)
     db.session.commit()
     
@@ -56,10 +179,22 @@ def login():
     username = data.get('username')
     password = data.get('password')
     
+    throttled = throttle_auth(username)
+    if throttled:
+        return throttled
+    
     user = User.query.filter_by(username=username).first()
     
-    if not user or not check_password_hash(user.password, password):
-        return jsonify({'message': 'Invalid username or password'}), 401
+    try:
+        if not user or not password or not hasher.verify(user.password, password):
+            return jsonify({'message': 'Invalid username or password'}), 401
+        
+        # Upgrade hashes made with older parameters while the password is at hand
+        if hasher.needs_rehash(user.password):
+            user.password = hasher.hash(password)
+            db.session.commit()
+    except HasherBusy:
+        return hasher_busy()
     
     session['user_id'] = user.id
     
@@ -68,6 +203,16 @@ def login():
         'user': {'id': user.id, 'username': user.username}
     }), 200
 
+# Unauthenticated so scrapers can reach it; set METRICS_TOKEN to require a bearer token
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    token = app.config['METRICS_TOKEN']
+    
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({'message': 'Unauthorized'}), 401
+    
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/logout', methods=['POST'])
 def logout():
     session.pop('user_id', None)
@@ -99,7 +244,12 @@ def get_lists():
     lists = TodoList.query.filter_by(user_id=user_id).all()
     
     return jsonify({
-        'lists': [{'id': lst.id, 'name': lst.name} for lst in lists]
+        'lists': [{
+            'id': lst.id,
+            'name': lst.name,
+            'total_count': lst.total_count,
+            'completed_count': lst.completed_count
+        } for lst in lists]
     }), 200
 
 @app.route('/api/lists', methods=['POST'])
@@ -118,7 +268,12 @@ def create_list():
     
     return jsonify({
         'message': 'List created successfully',
-        'list': {'id': todo_list.id, 'name': todo_list.name}
+        'list': {
+            'id': todo_list.id,
+            'name': todo_list.name,
+            'total_count': todo_list.total_count,
+            'completed_count': todo_list.completed_count
+        }
     }), 201
 
 # Apply login_required to all other routes
@@ -135,8 +290,9 @@ def delete_list(list_id):
     if not todo_list:
         return jsonify({'message': 'List not found'}), 404
     
-    # Delete all items in the list
+    # Delete all items in the list and its change log
     TodoItem.query.filter_by(list_id=list_id).delete()
+    purge_list(list_id)
     
     db.session.delete(todo_list)
     db.session.commit()
@@ -156,23 +312,144 @@ def get_items(list_id):
     if not todo_list:
         return jsonify({'message': 'List not found'}), 404
     
-    # Get all top-level items (no parent)
-    items = TodoItem.query.filter_by(list_id=list_id, parent_id=None).all()
+    # Every item change bumps the list's revision, so the revision identifies the tree
+    flat = request.args.get('format') == 'flat'
+    key = (list_id, todo_list.revision, 'flat' if flat else 'tree')
+    etag = '%s-%s-%s' % key
+    
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    
+    body = tree_cache.get(key)
+    
+    if body is None:
+        # Load the whole hierarchy in a single query and assemble it in memory
+        rows = fetch_list_items(list_id)
+        items = serialize_flat(rows) if flat else build_tree(rows)
+        body = jsonify({
+            'items': items,
+            'revision': todo_list.revision,
+            'total_count': todo_list.total_count,
+            'completed_count': todo_list.completed_count
+        }).get_data()
+        
+        # Only cache the tree if no other writer committed while it was loading
+        if db.session.scalar(select(TodoList.revision).where(TodoList.id == list_id)) == todo_list.revision:
+            tree_cache.put(key, body)
+    
+    response = Response(body, status=200, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.route('/api/lists/<int:list_id>/changes', methods=['GET'])
+@login_required
+def get_changes(list_id):
+    user_id = session.get('user_id')
     
-    # Function to recursively build item hierarchy
-    def build_item_tree(item):
-        children = TodoItem.query.filter_by(parent_id=item.id).all()
-        return {
-            'id': item.id,
-            'text': item.text,
-            'is_complete': item.is_complete,
-            'children': [build_item_tree(child) for child in children]
-        }
+    todo_list = TodoList.query.filter_by(id=list_id, user_id=user_id).first()
+    
+    if not todo_list:
+        return jsonify({'message': 'List not found'}), 404
+    
+    since = request.args.get('since', type=int)
+    
+    if since is None:
+        return jsonify({'message': 'since revision is required'}), 400
+    
+    # Tombstones the client has not seen were compacted, or the client's
+    # revision never existed in this list; either way it has to reload it
+    if since < todo_list.compacted_revision or since > todo_list.revision:
+        return jsonify({'revision': todo_list.revision, 'reset': True}), 200
+    
+    upserted, deleted = changes_since(list_id, since)
     
     return jsonify({
-        'items': [build_item_tree(item) for item in items]
+        'revision': todo_list.revision,
+        'reset': False,
+        'upserted': serialize_flat(upserted),
+        'deleted': deleted
     }), 200
 
+@app.route('/api/lists/<int:list_id>/events', methods=['GET'])
+@login_required
+def list_events(list_id):
+    user_id = session.get('user_id')
+    
+    todo_list = TodoList.query.filter_by(id=list_id, user_id=user_id).first()
+    
+    if not todo_list:
+        return jsonify({'message': 'List not found'}), 404
+    
+    try:
+        subscription = broker.subscribe(user_id, list_id)
+    except TooManyStreams:
+        response = jsonify({'message': 'Too many open event streams'})
+        response.headers['Retry-After'] = '5'
+        return response, 429
+    
+    # Read the revision after subscribing so no commit falls in between; the
+    # stream itself runs without the app context and holds no connection
+    revision = db.session.scalar(select(TodoList.revision).where(TodoList.id == list_id))
+    
+    response = Response(broker.stream(subscription, revision), mimetype='text/event-stream')
+    response.call_on_close(lambda: broker.unsubscribe(subscription))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/lists/<int:list_id>/export', methods=['GET'])
+@login_required
+def export_list(list_id):
+    user_id = session.get('user_id')
+    
+    todo_list = TodoList.query.filter_by(id=list_id, user_id=user_id).first()
+    
+    if not todo_list:
+        return jsonify({'message': 'List not found'}), 404
+    
+    # Stream the items page by page instead of building the whole list in memory
+    response = Response(stream_with_context(export_lines(list_id)), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = f'attachment; filename=list-{list_id}.ndjson'
+    return response
+
+@app.route('/api/lists/<int:list_id>/import', methods=['POST'])
+@login_required
+def import_list(list_id):
+    user_id = session.get('user_id')
+    
+    todo_list = TodoList.query.filter_by(id=list_id, user_id=user_id).first()
+    
+    if not todo_list:
+        return jsonify({'message': 'List not found'}), 404
+    
+    # Read and check the whole body before taking the write lock, so a slow
+    # upload does not block every other writer; the connection goes back to
+    # the pool in the meantime
+    db.session.close()
+    
+    try:
+        spool, count = spool_import(iter_lines(request.stream))
+    except ImportFailed as e:
+        return jsonify({'message': e.message, 'line': e.line}), 400
+    
+    with spool:
+        database.begin_write()
+        
+        # The list may have been deleted while the body was read
+        if not TodoList.query.filter_by(id=list_id, user_id=user_id).first():
+            return jsonify({'message': 'List not found'}), 404
+        
+        import_spooled(list_id, spool)
+        db.session.commit()
+    
+    return jsonify({
+        'message': 'Items imported successfully',
+        'imported': count
+    }), 201
+
 @app.route('/api/lists/<int:list_id>/items', methods=['POST'])
 @login_required
 def create_item(list_id):
@@ -181,6 +458,8 @@ def create_item(list_id):
     if not user_id:
         return jsonify({'message': 'Unauthorized'}), 401
     
+    database.begin_write()
+    
     todo_list = TodoList.query.filter_by(id=list_id, user_id=user_id).first()
     
     if not todo_list:
@@ -194,13 +473,13 @@ def create_item(list_id):
         return jsonify({'message': 'Item text is required'}), 400
     
     # If parent_id is provided, verify it exists and belongs to the same list
+    parent = None
     if parent_id:
         parent = TodoItem.query.filter_by(id=parent_id, list_id=list_id).first()
         if not parent:
             return jsonify({'message': 'Parent item not found'}), 404
     
-    item = TodoItem(text=text, list_id=list_id, parent_id=parent_id)
-    db.session.add(item)
+    item = create_tree_item(list_id, text, parent)
     db.session.commit()
     
     return jsonify({
@@ -209,6 +488,8 @@ def create_item(list_id):
             'id': item.id,
             'text': item.text,
             'is_complete': item.is_complete,
+            'total_count': item.total_count,
+            'completed_count': item.completed_count,
             'children': []
         }
     }), 201
@@ -221,6 +502,8 @@ def update_item(item_id):
     if not user_id:
         return jsonify({'message': 'Unauthorized'}), 401
     
+    database.begin_write()
+    
     item = TodoItem.query.join(TodoList).filter(
         TodoItem.id == item_id,
         TodoList.user_id == user_id
@@ -232,11 +515,11 @@ def update_item(item_id):
     data = request.get_json()
     
     if 'text' in data:
-        item.text = data['text']
+        set_text(item, data['text'])
     
     if 'is_complete' in data:
         new_status = data['is_complete']
-        update_item_and_children(item, new_status)
+        complete_subtree(item, new_status)
     
     db.session.commit()
     
@@ -245,15 +528,12 @@ def update_item(item_id):
         'item': {
             'id': item.id,
             'text': item.text,
-            'is_complete': item.is_complete
+            'is_complete': item.is_complete,
+            'total_count': item.total_count,
+            'completed_count': item.completed_count
         }
     }), 200
 
-def update_item_and_children(item, is_complete):
-    item.is_complete = is_complete
-    for child in item.children:
-        update_item_and_children(child, is_complete)
-
 @app.route('/api/items/<int:item_id>', methods=['DELETE'])
 @login_required
 def delete_item(item_id):
@@ -262,6 +542,8 @@ def delete_item(item_id):
     if not user_id:
         return jsonify({'message': 'Unauthorized'}), 401
     
+    database.begin_write()
+    
     item = TodoItem.query.join(TodoList).filter(
         TodoItem.id == item_id,
         TodoList.user_id == user_id
@@ -270,15 +552,8 @@ def delete_item(item_id):
     if not item:
         return jsonify({'message': 'Item not found'}), 404
     
-    # Function to recursively delete an item and all its children
-    def delete_item_tree(item_id):
-        children = TodoItem.query.filter_by(parent_id=item_id).all()
-        for child in children:
-            delete_item_tree(child.id)
-        
-        TodoItem.query.filter_by(id=item_id).delete()
-    
-    delete_item_tree(item_id)
+    # Delete the item and all its descendants in one statement
+    delete_subtree(item)
     db.session.commit()
     
     return jsonify({'message': 'Item deleted successfully'}), 200
@@ -297,6 +572,8 @@ def move_item(item_id):
     if not target_list_id:
         return jsonify({'message': 'Target list ID is required'}), 400
     
+    database.begin_write()
+    
     # Verify the item exists and belongs to the user
     item = TodoItem.query.join(TodoList).filter(
         TodoItem.id == item_id,
@@ -312,12 +589,62 @@ def move_item(item_id):
     if not target_list:
         return jsonify({'message': 'Target list not found'}), 404
     
-    # Move the item to the target list
-    item.list_id = target_list_id
-    db.session.commit()
+    # Move the item with all its subtasks to the top level of the target list
+    if item.list_id != target_list.id:
+        move_subtree(item, target_list.id)
+        db.session.commit()
     
     return jsonify({'message': 'Item moved successfully'}), 200
 
+@app.route('/api/batch', methods=['POST'])
+@login_required
+def batch():
+    user_id = session.get('user_id')
+    data = request.get_json()
+    operations = data.get('operations') if isinstance(data, dict) else None
+    
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'message': 'Operations are required'}), 400
+    
+    if len(operations) > MAX_OPERATIONS:
+        return jsonify({'message': f'At most {MAX_OPERATIONS} operations per batch'}), 400
+    
+    database.begin_write()
+    
+    # All operations are applied in one transaction; any failure rolls back the whole batch
+    try:
+        results = Batch(user_id).apply(operations)
+    except BatchError as e:
+        db.session.rollback()
+        return jsonify({'message': e.message, 'index': e.index}), e.status
+    
+    db.session.commit()
+    
+    return jsonify({
+        'message': 'Batch applied successfully',
+        'results': results
+    }), 200
+
+@app.route('/api/search', methods=['GET'])
+@login_required
+def search():
+    user_id = session.get('user_id')
+    query = request.args.get('q', '').strip()
+    
+    if not query:
+        return jsonify({'message': 'Search query is required'}), 400
+    
+    limit = min(max(request.args.get('limit', 20, type=int), 1), MAX_SEARCH_RESULTS)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    
+    # Ask for one extra hit to know whether there is a next page
+    results = search_items(user_id, query, limit + 1, offset)
+    
+    return jsonify({
+        'results': results[:limit],
+        'next_offset': offset + limit if len(results) > limit else None
+    }), 200
+
 if __name__ == '__main__':
     app.run(debug=True)
 
@@ -0,0 +1,185 @@
+from models import db, TodoList, TodoItem
+from tree import bulk_create_tree, set_text, complete_subtree, delete_subtree, move_subtree
+
+MAX_OPERATIONS = 1000
+
+
+# bool is a subclass of int, but true is not item 1
+def is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+class BatchError(Exception):
+    def __init__(self, index, message, status=400):
+        super().__init__(message)
+        self.index = index
+        self.message = message
+        self.status = status
+
+
+# Applies an ordered list of item operations inside the caller's transaction.
+# Creates may carry a client 'temp_id' that later operations can use in place
+# of a real id. Runs of consecutive creates are inserted in bulk, one INSERT
+# per nesting level within the run. Raises BatchError on the first invalid
+# operation; the caller is expected to roll back.
+class Batch:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.lists = {}
+        self.temp_ids = {}
+        self.pending = []
+        self.pending_temp_ids = {}
+        self.results = []
+
+    def apply(self, operations):
+        for index, operation in enumerate(operations):
+            if not isinstance(operation, dict):
+                raise BatchError(index, 'Operation must be an object')
+
+            op = operation.get('op')
+            if op == 'create':
+                self.create(index, operation)
+                continue
+
+            self.flush_creates()
+            if op == 'update':
+                self.update(index, operation)
+            elif op == 'delete':
+                self.delete(index, operation)
+            elif op == 'move':
+                self.move(index, operation)
+            else:
+                raise BatchError(index, f'Unknown operation: {op}')
+
+        self.flush_creates()
+        return self.results
+
+    # Ownership is checked once per list for the whole batch
+    def check_list(self, index, list_id, message='List not found'):
+        if not is_id(list_id):
+            raise BatchError(index, message, 404)
+        if list_id not in self.lists:
+            self.lists[list_id] = TodoList.query.filter_by(id=list_id, user_id=self.user_id).first() is not None
+        if not self.lists[list_id]:
+            raise BatchError(index, message, 404)
+
+    def resolve_id(self, ref):
+        if isinstance(ref, str) and ref in self.temp_ids:
+            return self.temp_ids[ref]
+        return ref
+
+    def get_item(self, index, ref):
+        item_id = self.resolve_id(ref)
+        item = None
+        if is_id(item_id):
+            # populate_existing refreshes rows rewritten by earlier bulk statements
+            item = TodoItem.query.filter_by(id=item_id).populate_existing().first()
+        if not item:
+            raise BatchError(index, 'Item not found', 404)
+        self.check_list(index, item.list_id, 'Item not found')
+        return item
+
+    def create(self, index, operation):
+        list_id = operation.get('list_id')
+        text = operation.get('text')
+        parent_ref = operation.get('parent_id')
+        temp_id = operation.get('temp_id')
+
+        if not text:
+            raise BatchError(index, 'Item text is required')
+        if temp_id is not None and (not isinstance(temp_id, str) or temp_id in self.temp_ids):
+            raise BatchError(index, 'temp_id must be a unique string')
+
+        self.check_list(index, list_id)
+
+        row = {'index': index, 'temp_id': temp_id, 'text': text, 'list_id': list_id,
+               'parent_id': None, 'parent_path': None, 'parent_row': None}
+
+        if parent_ref:
+            parent_row = self.pending_temp_ids.get(parent_ref) if isinstance(parent_ref, str) else None
+            if parent_row:
+                if parent_row['list_id'] != list_id:
+                    raise BatchError(index, 'Parent item not found', 404)
+                row['parent_row'] = parent_row
+            else:
+                parent_id = self.resolve_id(parent_ref)
+                parent = None
+                if is_id(parent_id):
+                    parent = TodoItem.query.filter_by(id=parent_id, list_id=list_id).populate_existing().first()
+                if not parent:
+                    raise BatchError(index, 'Parent item not found', 404)
+                row['parent_id'] = parent.id
+                row['parent_path'] = parent.path
+
+        if temp_id is not None:
+            self.temp_ids[temp_id] = None
+            self.pending_temp_ids[temp_id] = row
+        self.pending.append(row)
+        self.results.append(None)
+
+    # Insert the buffered creates level by level so every row's parent id and
+    # path are known by the time the row itself is inserted.
+    def flush_creates(self):
+        if not self.pending:
+            return
+
+        bulk_create_tree(self.pending)
+        for row in self.pending:
+            if row['temp_id'] is not None:
+                self.temp_ids[row['temp_id']] = row['id']
+            self.results[row['index']] = {
+                'status': 201,
+                'temp_id': row['temp_id'],
+                'item': {
+                    'id': row['id'],
+                    'text': row['text'],
+                    'is_complete': False,
+                    'total_count': 0,
+                    'completed_count': 0,
+                    'children': []
+                }
+            }
+
+        self.pending = []
+        self.pending_temp_ids = {}
+
+    def update(self, index, operation):
+        item = self.get_item(index, operation.get('id'))
+
+        if 'text' in operation:
+            if not operation['text']:
+                raise BatchError(index, 'Item text is required')
+            set_text(item, operation['text'])
+
+        if 'is_complete' in operation:
+            complete_subtree(item, operation['is_complete'])
+
+        db.session.flush()
+        self.results.append({
+            'status': 200,
+            'item': {
+                'id': item.id,
+                'text': item.text,
+                'is_complete': item.is_complete,
+                'total_count': item.total_count,
+                'completed_count': item.completed_count
+            }
+        })
+
+    def delete(self, index, operation):
+        item = self.get_item(index, operation.get('id'))
+        delete_subtree(item)
+        self.results.append({'status': 200, 'id': item.id})
+
+    def move(self, index, operation):
+        item = self.get_item(index, operation.get('id'))
+        target_list_id = operation.get('target_list_id')
+
+        if not target_list_id:
+            raise BatchError(index, 'Target list ID is required')
+        self.check_list(index, target_list_id, 'Target list not found')
+
+        if item.list_id != target_list_id:
+            move_subtree(item, target_list_id)
+            db.session.flush()
+        self.results.append({'status': 200, 'id': item.id})
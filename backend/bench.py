@@ -0,0 +1,362 @@
+# Backend benchmarks against a throwaway SQLite database.
+#
+#   python bench.py api [--lists 4] [--depth 6] [--fanout 4] [--size 2000]
+#                       [--output results.json] [--compare baseline.json]
+#
+# `api` reports latency percentiles and SQL statements per request for the
+# hot endpoints; --compare exits non-zero if a scenario regressed.
+#   python bench.py indexes [--users 50] [--lists 10] [--items 200]
+#
+# The app reads its configuration at import time, so every benchmark points
+# DATABASE_URL at a temporary file before importing it.
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+BENCH_PASSWORD = 'bench-password'
+
+
+def load_app(db_path):
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    # Repeated logins would otherwise be throttled after a few attempts
+    os.environ.setdefault('AUTH_ATTEMPTS_PER_USERNAME', '1000000')
+    os.environ.setdefault('AUTH_ATTEMPTS_PER_IP', '1000000')
+    from app import app
+    app.config['SESSION_COOKIE_SECURE'] = False
+    return app
+
+# Counts the SQL statements the engine executes
+class StatementCounter:
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    def pick(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+    return {
+        'p50_ms': round(statistics.median(ordered) * 1000, 3),
+        'p95_ms': round(pick(0.95) * 1000, 3),
+        'p99_ms': round(pick(0.99) * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3)
+    }
+
+# Shape of a synthetic tree: breadth first, every item has `fanout` children
+# until the tree is `depth` levels deep or has `size` items. Yields
+# (position, parent position) pairs.
+def generate_tree(depth, fanout, size):
+    level = [None]
+    position = 0
+    for _ in range(depth):
+        next_level = []
+        for parent in level:
+            for _ in range(fanout if parent is not None else 1):
+                if position >= size:
+                    return
+                yield position, parent
+                next_level.append(position)
+                position += 1
+        level = next_level
+
+# Create a tree of items through the app's own bulk insert, returning the ids
+# in generation order
+def seed_tree(list_id, depth, fanout, size, prefix='item'):
+    from tree import bulk_create_tree
+
+    rows = []
+    for position, parent in generate_tree(depth, fanout, size):
+        rows.append({'text': f'{prefix} {position}', 'list_id': list_id,
+                     'parent_id': None, 'parent_path': None,
+                     'parent_row': rows[parent] if parent is not None else None})
+    bulk_create_tree(rows)
+    return [row['id'] for row in rows]
+
+def timed(fn, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+# Insert users, lists and items straight through Core, which is far faster
+# than going through the API and fine for read benchmarks. The items of each
+# list form a tree where every item has up to `fanout` children.
+def seed_lists(users, lists_per_user, items_per_list, fanout=5):
+    from models import db, User, TodoList, TodoItem
+    from sqlalchemy import insert, select, update
+
+    db.session.execute(insert(User), [
+        {'username': f'user{n}', 'password': 'x'} for n in range(users)
+    ])
+    user_ids = [user.id for user in User.query.all()]
+    db.session.execute(insert(TodoList), [
+        {'name': f'list{n}', 'user_id': user_id}
+        for user_id in user_ids for n in range(lists_per_user)
+    ])
+    list_ids = [todo_list.id for todo_list in TodoList.query.all()]
+
+    rows = []
+    for list_id in list_ids:
+        for n in range(items_per_list):
+            rows.append({'text': f'item {n}', 'list_id': list_id})
+    db.session.execute(insert(TodoItem), rows)
+
+    updates = []
+    for list_id in list_ids:
+        ids = db.session.scalars(select(TodoItem.id).where(TodoItem.list_id == list_id).order_by(TodoItem.id)).all()
+        paths = []
+        for n, item_id in enumerate(ids):
+            parent = (n - 1) // fanout if n else None
+            paths.append((paths[parent] if parent is not None else '/') + f'{item_id}/')
+            updates.append({'id': item_id, 'parent_id': ids[parent] if parent is not None else None, 'path': paths[n]})
+    db.session.execute(update(TodoItem), updates)
+    db.session.commit()
+    return user_ids, list_ids
+
+# A single request scenario. setup() runs before every timed request and may
+# return arguments for request(); neither its time nor its SQL is counted.
+class Scenario:
+    def __init__(self, name, request, setup=None):
+        self.name = name
+        self.request = request
+        self.setup = setup
+
+    def run(self, counter, runs):
+        samples = []
+        statements = []
+        for _ in range(runs):
+            args = self.setup() if self.setup else ()
+            before = counter.count
+            start = time.perf_counter()
+            response = self.request(*args)
+            samples.append(time.perf_counter() - start)
+            statements.append(counter.count - before)
+            if response.status_code >= 400:
+                raise RuntimeError(f'{self.name}: HTTP {response.status_code} {response.get_data(as_text=True)}')
+        result = percentiles(samples)
+        result['statements'] = round(statistics.mean(statements), 1)
+        result['runs'] = runs
+        return result
+
+# Time the API's hot paths through the Flask test client
+def bench_api(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        app = load_app(os.path.join(tmp, 'bench.db'))
+        from models import db, User, TodoList
+        from hashing import hasher
+        from cache import tree_cache
+
+        with app.app_context():
+            user = User(username='bench', password=hasher.hash(BENCH_PASSWORD))
+            db.session.add(user)
+            db.session.flush()
+            lists = [TodoList(name=f'list {n}', user_id=user.id) for n in range(args.lists + 1)]
+            db.session.add_all(lists)
+            db.session.flush()
+            list_ids = [todo_list.id for todo_list in lists]
+            spare_list_id = list_ids.pop()
+
+            trees = [seed_tree(list_id, args.depth, args.fanout, args.size) for list_id in list_ids]
+            db.session.commit()
+            counter = StatementCounter(db.engine)
+
+        client = app.test_client()
+        client.post('/api/login', json={'username': 'bench', 'password': BENCH_PASSWORD})
+        rng = random.Random(args.seed)
+        completed = {}
+
+        def uncached_get():
+            tree_cache.clear()
+            return (rng.choice(list_ids),)
+
+        # Alternate every root between complete and incomplete so each run
+        # flips the whole tree
+        def toggle_root():
+            root_id = rng.choice(trees)[0]
+            completed[root_id] = not completed.get(root_id, False)
+            return root_id, completed[root_id]
+
+        # Every run deletes a fresh chain of `chain` nested items
+        def deep_subtree():
+            with app.app_context():
+                root_id = seed_tree(list_ids[0], args.chain, 1, args.chain, prefix='doomed')[0]
+                db.session.commit()
+            return (root_id,)
+
+        # Move the second item of a tree, with its subtree, to the spare list
+        # and back on alternate runs
+        moves = {'count': 0}
+        def move_target():
+            moves['count'] += 1
+            tree = trees[0]
+            target = spare_list_id if moves['count'] % 2 else list_ids[0]
+            return tree[1] if len(tree) > 1 else tree[0], target
+
+        scenarios = [
+            Scenario('get_items', lambda list_id: client.get(f'/api/lists/{list_id}/items'), uncached_get),
+            Scenario('get_items_cached', lambda: client.get(f'/api/lists/{list_ids[0]}/items')),
+            Scenario('update_item_cascade',
+                     lambda item_id, value: client.patch(f'/api/items/{item_id}', json={'is_complete': value}),
+                     toggle_root),
+            Scenario('delete_item_subtree', lambda item_id: client.delete(f'/api/items/{item_id}'), deep_subtree),
+            Scenario('move_item',
+                     lambda item_id, target: client.post(f'/api/items/{item_id}/move', json={'target_list_id': target}),
+                     move_target),
+            Scenario('search', lambda query: client.get('/api/search', query_string={'q': query}),
+                     lambda: (f'item {rng.randint(10, 999)}',)),
+            Scenario('login', lambda: client.post('/api/login', json={'username': 'bench', 'password': BENCH_PASSWORD}))
+        ]
+
+        results = {}
+        for scenario in scenarios:
+            if args.only and scenario.name not in args.only:
+                continue
+            runs = args.login_runs if scenario.name == 'login' else args.runs
+            results[scenario.name] = scenario.run(counter, runs)
+            print_result(scenario.name, results[scenario.name])
+
+        hasher.shutdown()
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'config': {key: getattr(args, key) for key in ('lists', 'depth', 'fanout', 'size', 'chain', 'runs', 'login_runs', 'seed')},
+        'results': results
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Results written to {args.output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report, args.threshold)
+
+def print_result(name, result):
+    print(f'{name:22} p50 {result["p50_ms"]:9.3f} ms  p95 {result["p95_ms"]:9.3f} ms  '
+          f'p99 {result["p99_ms"]:9.3f} ms  {result["statements"]:7.1f} statements')
+
+# Compare two saved runs. A scenario regressed if its p50 grew by more than
+# `threshold` times or it issues more statements per request than before.
+def compare(baseline, current, threshold):
+    if baseline.get('config') != current['config']:
+        print('warning: the runs used different configurations')
+
+    regressions = 0
+    print(f'{"":22} {"p50 before":>12} {"p50 now":>12} {"ratio":>7} {"stmts before":>13} {"stmts now":>10}')
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        ratio = result['p50_ms'] / before['p50_ms'] if before['p50_ms'] else float('inf')
+        regressed = ratio > threshold or result['statements'] > before['statements']
+        regressions += regressed
+        print(f'{name:22} {before["p50_ms"]:12.3f} {result["p50_ms"]:12.3f} {ratio:7.2f} '
+              f'{before["statements"]:13.1f} {result["statements"]:10.1f}{"  REGRESSED" if regressed else ""}')
+
+    if regressions:
+        raise SystemExit(f'{regressions} scenario(s) regressed')
+
+LOOKUP_INDEXES = ['ix_todo_item_list_id', 'ix_todo_item_parent_id', 'ix_todo_list_user_id']
+
+# Time the lookups the API runs most with and without the lookup indexes
+def bench_indexes(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        app = load_app(os.path.join(tmp, 'bench.db'))
+        from models import db, TodoList, TodoItem
+        from migrations import add_lookup_indexes
+        from tree import fetch_list_items
+        from sqlalchemy import text
+
+        with app.app_context():
+            user_ids, list_ids = seed_lists(args.users, args.lists, args.items)
+            rng = random.Random(args.seed)
+
+            queries = {
+                'items of a list': (
+                    lambda: fetch_list_items(rng.choice(list_ids)),
+                    'SELECT id FROM todo_item WHERE list_id = 1 ORDER BY id'
+                ),
+                'lists of a user': (
+                    lambda: TodoList.query.filter_by(user_id=rng.choice(user_ids)).all(),
+                    'SELECT id FROM todo_list WHERE user_id = 1'
+                ),
+                'children of an item': (
+                    lambda: TodoItem.query.filter_by(parent_id=rng.randint(1, len(list_ids) * args.items)).all(),
+                    'SELECT id FROM todo_item WHERE parent_id = 1'
+                )
+            }
+
+            def run(label):
+                print(label)
+                for name, (fn, sql) in queries.items():
+                    plan = db.session.execute(text('EXPLAIN QUERY PLAN ' + sql)).all()
+                    result = timed(fn, args.runs)
+                    print(f'  {name:22} p50 {result["p50_ms"]:8.3f} ms  p95 {result["p95_ms"]:8.3f} ms  '
+                          f'{" / ".join(row[-1] for row in plan)}')
+
+            # End the session's read transaction after each schema change so
+            # it sees the new schema
+            with db.engine.begin() as conn:
+                for name in LOOKUP_INDEXES:
+                    conn.execute(text(f'DROP INDEX IF EXISTS {name}'))
+            db.session.commit()
+            run('without lookup indexes')
+
+            add_lookup_indexes()
+            db.session.commit()
+            run('with lookup indexes')
+
+            db.session.remove()
+            db.engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser(description='Backend benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    api = subparsers.add_parser('api', help='latency and SQL statements of the API hot paths')
+    api.add_argument('--lists', type=int, default=4, help='lists with one tree each')
+    api.add_argument('--depth', type=int, default=6, help='levels per tree')
+    api.add_argument('--fanout', type=int, default=4, help='children per item')
+    api.add_argument('--size', type=int, default=2000, help='maximum items per tree')
+    api.add_argument('--chain', type=int, default=100, help='depth of the subtrees deleted by delete_item_subtree')
+    api.add_argument('--runs', type=int, default=50)
+    api.add_argument('--login-runs', type=int, default=10)
+    api.add_argument('--seed', type=int, default=1)
+    api.add_argument('--only', nargs='*', help='scenarios to run')
+    api.add_argument('--output', help='write the results to this JSON file')
+    api.add_argument('--compare', help='compare against a JSON file written by --output')
+    api.add_argument('--threshold', type=float, default=1.25,
+                     help='p50 ratio above which a scenario counts as regressed')
+    api.set_defaults(run=bench_api)
+
+    indexes = subparsers.add_parser('indexes', help='scan-bound lookups with and without indexes')
+    indexes.add_argument('--users', type=int, default=50)
+    indexes.add_argument('--lists', type=int, default=10, help='lists per user')
+    indexes.add_argument('--items', type=int, default=200, help='items per list')
+    indexes.add_argument('--runs', type=int, default=200)
+    indexes.add_argument('--seed', type=int, default=1)
+    indexes.set_defaults(run=bench_indexes)
+
+    args = parser.parse_args()
+    args.run(args)
+
+if __name__ == '__main__':
+    main()
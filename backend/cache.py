@@ -0,0 +1,71 @@
+from collections import OrderedDict
+import threading
+
+from changes import on_commit
+
+
+# LRU cache of serialized list trees, bounded by the total size of the cached
+# bodies. Keys start with the list id and include the list's revision, so an
+# entry can never be served after the list changed; entries of changed lists
+# are also dropped on commit to give their memory back straight away.
+class TreeCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            body = self.entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            self.entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def invalidate(self, list_id):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == list_id]:
+                self.size -= len(self.entries.pop(key))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes
+            }
+
+
+tree_cache = TreeCache(32 * 1024 * 1024)
+
+@on_commit
+def _invalidate_committed(revisions, items):
+    for list_id in revisions:
+        tree_cache.invalidate(list_id)
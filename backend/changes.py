@@ -0,0 +1,146 @@
+from sqlalchemy import select, update, delete, literal, event
+from sqlalchemy.dialects.sqlite import insert
+from models import db, TodoList, TodoItem, ItemChange
+
+# Tombstones kept per list before the oldest are compacted away
+MAX_TOMBSTONES = 1000
+
+# Changed item ids remembered per list and transaction for commit callbacks;
+# beyond this the callbacks are only told that the list changed
+MAX_TRACKED_ITEMS = 1000
+
+_commit_callbacks = []
+
+
+# Every transaction bumps a list's revision once, however many items it
+# touches, and tags all of its changes with that revision.
+def current_revision(list_id):
+    revisions = db.session.info.setdefault('revisions', {})
+    if list_id not in revisions:
+        revisions[list_id] = db.session.execute(
+            update(TodoList)
+            .where(TodoList.id == list_id)
+            .values(revision=TodoList.revision + 1)
+            .returning(TodoList.revision)
+            .execution_options(synchronize_session=False)
+        ).scalar()
+    return revisions[list_id]
+
+def _track(list_id, item_ids, deleted):
+    tracked = db.session.info.setdefault('changed_items', {}).setdefault(list_id, {})
+    if tracked is None:
+        return
+    for item_id in item_ids:
+        tracked[item_id] = deleted
+    if len(tracked) > MAX_TRACKED_ITEMS:
+        db.session.info['changed_items'][list_id] = None
+
+# Register a function to be called after every commit that changed lists. It
+# gets a dict of list id to the list's new revision, or None for deleted
+# lists, and a dict of list id to {item id: deleted} for the items that
+# changed, or None if too many items changed to list them.
+def on_commit(callback):
+    _commit_callbacks.append(callback)
+    return callback
+
+@event.listens_for(db.session, 'after_commit')
+def _notify_commit(session):
+    revisions = session.info.pop('revisions', None)
+    items = session.info.pop('changed_items', {})
+    if revisions:
+        for callback in _commit_callbacks:
+            callback(revisions, items)
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _forget_revisions(session, previous_transaction):
+    session.info.pop('revisions', None)
+    session.info.pop('changed_items', None)
+
+# Keep one row per item, overwritten by the item's latest change
+def _on_conflict(statement):
+    return statement.on_conflict_do_update(
+        index_elements=['list_id', 'item_id'],
+        set_={'revision': statement.excluded.revision, 'deleted': statement.excluded.deleted}
+    )
+
+def record_items(list_id, item_ids, deleted=False):
+    if not item_ids:
+        return
+    revision = current_revision(list_id)
+    db.session.execute(_on_conflict(insert(ItemChange)), [
+        {'list_id': list_id, 'item_id': item_id, 'revision': revision, 'deleted': deleted}
+        for item_id in item_ids
+    ])
+    _track(list_id, item_ids, deleted)
+    if deleted:
+        compact(list_id)
+
+# Record every item matched by the given TodoItem filters with one
+# INSERT ... SELECT, without loading the items.
+def record_matching(list_id, *criteria, deleted=False):
+    revision = current_revision(list_id)
+    item_ids = db.session.scalars(_on_conflict(insert(ItemChange).from_select(
+        ['list_id', 'item_id', 'revision', 'deleted'],
+        select(literal(list_id), TodoItem.id, literal(revision), literal(deleted)).where(*criteria)
+    )).returning(ItemChange.item_id))
+    _track(list_id, item_ids, deleted)
+    if deleted:
+        compact(list_id)
+
+# Keep at most MAX_TOMBSTONES tombstones per list. Clients that last synced
+# before the newest dropped tombstone can no longer be sent a complete delta
+# and have to reload the list.
+def compact(list_id):
+    cutoff = db.session.execute(
+        select(ItemChange.revision)
+        .where(ItemChange.list_id == list_id, ItemChange.deleted.is_(True))
+        .order_by(ItemChange.revision.desc())
+        .offset(MAX_TOMBSTONES)
+        .limit(1)
+    ).scalar()
+
+    if cutoff is None:
+        return
+
+    db.session.execute(
+        delete(ItemChange)
+        .where(ItemChange.list_id == list_id, ItemChange.deleted.is_(True), ItemChange.revision <= cutoff)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        update(TodoList)
+        .where(TodoList.id == list_id, TodoList.compacted_revision < cutoff)
+        .values(compacted_revision=cutoff)
+        .execution_options(synchronize_session=False)
+    )
+
+def purge_list(list_id):
+    ItemChange.query.filter_by(list_id=list_id).delete(synchronize_session=False)
+    db.session.info.setdefault('revisions', {})[list_id] = None
+
+# Items changed after the given revision: current rows of the upserted items
+# and the ids of the removed ones.
+def changes_since(list_id, since):
+    upserted = db.session.execute(
+        select(TodoItem.id, TodoItem.text, TodoItem.is_complete, TodoItem.parent_id,
+               TodoItem.total_count, TodoItem.completed_count)
+        .join(ItemChange, ItemChange.item_id == TodoItem.id)
+        .where(
+            ItemChange.list_id == list_id,
+            ItemChange.revision > since,
+            ItemChange.deleted.is_(False)
+        )
+        .order_by(TodoItem.id)
+    ).all()
+
+    deleted = db.session.scalars(
+        select(ItemChange.item_id)
+        .where(
+            ItemChange.list_id == list_id,
+            ItemChange.revision > since,
+            ItemChange.deleted.is_(True)
+        )
+        .order_by(ItemChange.item_id)
+    ).all()
+
+    return upserted, deleted
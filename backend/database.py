@@ -0,0 +1,30 @@
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from models import db
+import sqlite3
+
+# Milliseconds a connection waits for another writer's lock before failing
+busy_timeout = 5000
+
+
+# Configure every SQLite connection for concurrent use: WAL lets readers run
+# alongside the single writer, and the busy timeout makes writers queue for
+# the lock instead of failing with "database is locked" straight away.
+@event.listens_for(Engine, 'connect')
+def _configure_sqlite(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f'PRAGMA busy_timeout={int(busy_timeout)}')
+    cursor.close()
+
+
+# Take the write lock for the session's transaction straight away. pysqlite
+# only begins a transaction at the first write, so rows read before it (an
+# item's path or counters, say) could be changed by another writer before the
+# request's own writes land. An empty UPDATE begins the transaction and waits
+# for the lock like any other write; reads after it see the latest data.
+def begin_write():
+    db.session.execute(text('UPDATE todo_list SET id = id WHERE 0'))
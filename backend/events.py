@@ -0,0 +1,133 @@
+from collections import deque
+import json
+import threading
+
+from changes import on_commit
+
+
+class TooManyStreams(Exception):
+    pass
+
+
+class Subscription:
+    def __init__(self, user_id, list_id):
+        self.user_id = user_id
+        self.list_id = list_id
+        self.messages = deque()
+        self.ready = threading.Event()
+        self.closed = False
+
+
+def format_event(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append('data: ' + json.dumps(data, separators=(',', ':')))
+    return '\n'.join(lines) + '\n\n'
+
+
+# In-process fan-out of committed list changes to Server-Sent Events streams.
+# Publishing formats each event once and appends it to the subscribers'
+# queues without blocking; a subscriber whose queue is full gets a single
+# resync event instead, telling it to catch up through the changes endpoint.
+# Idle streams wait on an Event with a heartbeat timeout, which only costs a
+# greenlet rather than an OS thread under the gevent worker in gunicorn.conf.py.
+# A server with a thread per request still holds one thread per open stream,
+# so max_streams caps them across all users as well as max_per_user per user.
+class EventBroker:
+    def __init__(self, max_per_user=5, max_streams=100, heartbeat=15, max_queue=100):
+        self.max_per_user = max_per_user
+        self.max_streams = max_streams
+        self.heartbeat = heartbeat
+        self.max_queue = max_queue
+        self.subscribers = {}
+        self.connections = {}
+        self.streams = 0
+        self.lock = threading.Lock()
+
+    def subscribe(self, user_id, list_id):
+        with self.lock:
+            if self.streams >= self.max_streams or self.connections.get(user_id, 0) >= self.max_per_user:
+                raise TooManyStreams()
+            self.streams += 1
+            self.connections[user_id] = self.connections.get(user_id, 0) + 1
+            subscription = Subscription(user_id, list_id)
+            self.subscribers.setdefault(list_id, set()).add(subscription)
+            return subscription
+
+    # Safe to call more than once; the stream and the response both call it
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscribers = self.subscribers.get(subscription.list_id)
+            if subscribers is None or subscription not in subscribers:
+                return
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self.subscribers[subscription.list_id]
+            self.streams -= 1
+            self.connections[subscription.user_id] -= 1
+            if not self.connections[subscription.user_id]:
+                del self.connections[subscription.user_id]
+        subscription.closed = True
+        subscription.ready.set()
+
+    def publish(self, list_id, message, close=False):
+        with self.lock:
+            subscribers = list(self.subscribers.get(list_id, ()))
+        for subscription in subscribers:
+            if len(subscription.messages) >= self.max_queue:
+                subscription.messages.clear()
+                subscription.messages.append(format_event('resync', {}))
+            else:
+                subscription.messages.append(message)
+            if close:
+                subscription.closed = True
+            subscription.ready.set()
+
+    def stream(self, subscription, revision):
+        try:
+            yield 'retry: 5000\n' + format_event('hello', {'revision': revision}, revision)
+            while True:
+                if not subscription.ready.wait(self.heartbeat):
+                    yield ': ping\n\n'
+                    continue
+                subscription.ready.clear()
+                while subscription.messages:
+                    yield subscription.messages.popleft()
+                if subscription.closed:
+                    return
+        finally:
+            self.unsubscribe(subscription)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'streams': self.streams,
+                'lists': len(self.subscribers)
+            }
+
+
+broker = EventBroker()
+
+@on_commit
+def _publish_committed(revisions, items):
+    for list_id, revision in revisions.items():
+        if list_id not in broker.subscribers:
+            continue
+
+        if revision is None:
+            broker.publish(list_id, format_event('list_deleted', {}), close=True)
+            continue
+
+        # Only ids go out; clients fetch the items from the changes endpoint
+        changed = items.get(list_id)
+        if changed is None:
+            data = {'revision': revision, 'truncated': True}
+        else:
+            data = {
+                'revision': revision,
+                'upserted': [item_id for item_id, deleted in changed.items() if not deleted],
+                'deleted': [item_id for item_id, deleted in changed.items() if deleted]
+            }
+        broker.publish(list_id, format_event('changes', data, revision))
@@ -0,0 +1,12 @@
+# Production server settings: gunicorn --config gunicorn.conf.py app:app
+#
+# The gevent worker runs every request, including the long-lived event
+# streams of /api/lists/<id>/events, in a greenlet, so an idle stream does not
+# hold an OS thread. Events are fanned out within one process, so a single
+# worker serves all streams; it handles worker_connections requests at once.
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = 1
+worker_class = 'gevent'
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 1000))
@@ -0,0 +1,81 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import generate_password_hash, check_password_hash
+import threading
+
+
+class HasherBusy(Exception):
+    pass
+
+
+# Werkzeug fills in defaults for the parameters a method leaves out, and
+# stores the full parameter list in the hash
+DEFAULT_PARAMETERS = {
+    'scrypt': ['32768', '8', '1'],
+    'pbkdf2': ['sha256', '600000']
+}
+
+def canonical_method(method):
+    name, *params = method.split(':')
+    defaults = DEFAULT_PARAMETERS.get(name)
+    if defaults is None:
+        return method
+    return ':'.join([name] + params + defaults[len(params):])
+
+
+# Runs the deliberately slow password hashing in a pool of worker processes,
+# so a burst of logins cannot starve the request threads of CPU. At most
+# max_pending hashes may be queued or running; beyond that callers get
+# HasherBusy straight away instead of piling up. With workers set to 0 the
+# hashes are computed inline, which is handy for development.
+class PasswordHasher:
+    def __init__(self, method='scrypt', workers=2, max_pending=8):
+        self.method = method
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor = None
+        self.slots = None
+        self.lock = threading.Lock()
+
+    def _submit(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+                self.slots = threading.BoundedSemaphore(self.max_pending)
+            executor = self.executor
+            slots = self.slots
+
+        if not slots.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            return executor.submit(fn, *args).result()
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool for the next caller
+            with self.lock:
+                if self.executor is executor:
+                    self.executor = None
+            raise
+        finally:
+            slots.release()
+
+    def hash(self, password):
+        return self._submit(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._submit(check_password_hash, pwhash, password)
+
+    # True if the hash was made with other parameters than the configured ones
+    def needs_rehash(self, pwhash):
+        return pwhash.split('$', 1)[0] != canonical_method(self.method)
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+
+hasher = PasswordHasher()
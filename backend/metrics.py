@@ -0,0 +1,158 @@
+from flask import g, request, has_request_context
+from sqlalchemy import event
+import logging
+import threading
+import time
+
+logger = logging.getLogger('todo.slow_queries')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 500, 1000)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+    # Prometheus buckets are cumulative
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+class RouteStats:
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.statements = Histogram(STATEMENT_BUCKETS)
+        self.db_seconds = 0.0
+
+
+# Request-scoped instrumentation of the Flask app and its SQLAlchemy engine.
+# Each request counts its statements and their time in flask.g; when the
+# response goes out the numbers are folded into per-route aggregates under a
+# single short lock, so the cost per request is a few clock reads and dict
+# updates. Statements slower than slow_query_ms are logged as warnings.
+class Metrics:
+    def __init__(self, slow_query_ms=100, server_timing=False):
+        self.slow_query_ms = slow_query_ms
+        self.server_timing = server_timing
+        self.routes = {}
+        self.slow_queries = 0
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def init_app(self, app, engine):
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        event.listen(engine, 'before_cursor_execute', self._before_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_execute)
+
+    # Register a function returning extra (name, type, help, value) samples
+    def collector(self, fn):
+        self.collectors.append(fn)
+        return fn
+
+    def _start_request(self):
+        g.metrics_start = time.perf_counter()
+        g.sql_statements = 0
+        g.sql_seconds = 0.0
+
+    # The start time lives on the statement's execution context, which is
+    # dropped with the statement even when it fails and after_cursor_execute
+    # never fires
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_start = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, '_metrics_start', None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+
+        route = None
+        if has_request_context() and 'sql_statements' in g:
+            g.sql_statements += 1
+            g.sql_seconds += elapsed
+            route = request.url_rule.rule if request.url_rule else request.path
+
+        if elapsed * 1000 >= self.slow_query_ms:
+            with self.lock:
+                self.slow_queries += 1
+            logger.warning('Slow query (%.1f ms) in %s: %s', elapsed * 1000, route or '-', ' '.join(statement.split())[:500])
+
+    def _finish_request(self, response):
+        if 'metrics_start' not in g:
+            return response
+
+        # Streamed bodies are still being produced at this point, so their
+        # latency only covers the work done before the first byte
+        elapsed = time.perf_counter() - g.metrics_start
+        key = (request.url_rule.rule if request.url_rule else 'unmatched', request.method)
+
+        with self.lock:
+            stats = self.routes.get(key)
+            if stats is None:
+                stats = self.routes[key] = RouteStats()
+            stats.latency.observe(elapsed)
+            stats.statements.observe(g.sql_statements)
+            stats.db_seconds += g.sql_seconds
+
+        if self.server_timing:
+            response.headers.add('Server-Timing', f'app;dur={elapsed * 1000:.2f}')
+            response.headers.add('Server-Timing', f'db;dur={g.sql_seconds * 1000:.2f};desc="{g.sql_statements} queries"')
+
+        return response
+
+    # Metrics in the Prometheus text exposition format
+    def render(self):
+        lines = []
+
+        def header(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        def histogram(name, get):
+            for (route, method), stats in routes:
+                labels = f'route="{route}",method="{method}"'
+                hist = get(stats)
+                for bound, total in hist.cumulative():
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {total}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {hist.count}')
+                lines.append(f'{name}_sum{{{labels}}} {hist.sum}')
+                lines.append(f'{name}_count{{{labels}}} {hist.count}')
+
+        with self.lock:
+            routes = sorted(self.routes.items())
+            header('todo_http_request_duration_seconds', 'histogram', 'Time spent handling requests')
+            histogram('todo_http_request_duration_seconds', lambda stats: stats.latency)
+            header('todo_db_statements_per_request', 'histogram', 'SQL statements executed per request')
+            histogram('todo_db_statements_per_request', lambda stats: stats.statements)
+            header('todo_db_seconds_total', 'counter', 'Time spent executing SQL statements')
+            for (route, method), stats in routes:
+                lines.append(f'todo_db_seconds_total{{route="{route}",method="{method}"}} {stats.db_seconds}')
+            header('todo_db_slow_queries_total', 'counter', 'SQL statements slower than the slow query threshold')
+            lines.append(f'todo_db_slow_queries_total {self.slow_queries}')
+
+        for collect in self.collectors:
+            for name, kind, help_text, value in collect():
+                header(name, kind, help_text)
+                lines.append(f'{name} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
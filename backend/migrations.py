@@ -0,0 +1,148 @@
+from sqlalchemy import MetaData, inspect, select, text
+from sqlalchemy.schema import CreateTable
+from models import db, User, TodoList, TodoItem
+from tree import rebuild_paths, check_counts
+
+
+# Versioned schema migrations. The schema version of a database is stored in
+# SQLite's PRAGMA user_version and every migration above it is applied in
+# order. The first migration runs db.create_all(), which creates missing
+# tables with the current models' columns, so every later migration has to
+# check whether its change is already in place.
+MIGRATIONS = []
+
+def migration(version, description):
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        return fn
+    return register
+
+def _columns(table):
+    return {column['name'] for column in inspect(db.engine).get_columns(table)}
+
+@migration(1, 'create tables')
+def create_tables():
+    db.create_all()
+
+@migration(2, 'materialized item paths')
+def add_item_paths():
+    if 'path' not in _columns('todo_item'):
+        with db.engine.begin() as conn:
+            conn.execute(text('ALTER TABLE todo_item ADD COLUMN path TEXT'))
+            conn.execute(text('CREATE INDEX IF NOT EXISTS ix_todo_item_path ON todo_item (path)'))
+
+    # Only the path column exists yet, so no whole items are loaded here
+    if db.session.scalar(select(TodoItem.id).where(TodoItem.path.is_(None)).limit(1)):
+        rebuild_paths()
+
+# Existing lists start at revision 1 with everything before it compacted, so
+# clients syncing from revision 0 reload them instead of missing items
+@migration(3, 'list revisions')
+def add_list_revisions():
+    if 'revision' not in _columns('todo_list'):
+        with db.engine.begin() as conn:
+            conn.execute(text('ALTER TABLE todo_list ADD COLUMN revision INTEGER NOT NULL DEFAULT 1'))
+            conn.execute(text('ALTER TABLE todo_list ADD COLUMN compacted_revision INTEGER NOT NULL DEFAULT 1'))
+
+# SQLite appends the rowid to every index, so (list_id) alone already serves
+# "items of a list in id order" and (user_id) serves "lists of a user in id
+# order"; the id is spelled out to make that explicit.
+@migration(4, 'lookup indexes')
+def add_lookup_indexes():
+    with db.engine.begin() as conn:
+        conn.execute(text('CREATE INDEX IF NOT EXISTS ix_todo_item_list_id ON todo_item (list_id, id)'))
+        conn.execute(text('CREATE INDEX IF NOT EXISTS ix_todo_item_parent_id ON todo_item (parent_id)'))
+        conn.execute(text('CREATE INDEX IF NOT EXISTS ix_todo_list_user_id ON todo_list (user_id, id)'))
+        conn.execute(text('ANALYZE'))
+
+# Full-text index over item text. The index reads its content from a view
+# that adds a per-list key, so a search can be narrowed to a user's lists
+# inside FTS5 instead of matching every user's items and filtering after.
+# Triggers keep it in sync with every write to todo_item, including the bulk
+# INSERTs and set-based UPDATEs and DELETEs that bypass the ORM.
+@migration(5, 'full-text search index')
+def add_search_index():
+    with db.engine.begin() as conn:
+        conn.execute(text(
+            "CREATE VIEW IF NOT EXISTS todo_item_search AS "
+            "SELECT id, text, 'l' || list_id AS list_key FROM todo_item"
+        ))
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS todo_item_fts USING fts5("
+            "text, list_key, content='todo_item_search', content_rowid='id', prefix='2 3')"
+        ))
+        conn.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS todo_item_fts_insert AFTER INSERT ON todo_item BEGIN "
+            "INSERT INTO todo_item_fts (rowid, text, list_key) VALUES (new.id, new.text, 'l' || new.list_id); "
+            "END"
+        ))
+        conn.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS todo_item_fts_delete AFTER DELETE ON todo_item BEGIN "
+            "INSERT INTO todo_item_fts (todo_item_fts, rowid, text, list_key) VALUES ('delete', old.id, old.text, 'l' || old.list_id); "
+            "END"
+        ))
+        conn.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS todo_item_fts_update AFTER UPDATE OF text, list_id ON todo_item BEGIN "
+            "INSERT INTO todo_item_fts (todo_item_fts, rowid, text, list_key) VALUES ('delete', old.id, old.text, 'l' || old.list_id); "
+            "INSERT INTO todo_item_fts (rowid, text, list_key) VALUES (new.id, new.text, 'l' || new.list_id); "
+            "END"
+        ))
+        # Rank by the item text only
+        conn.execute(text("INSERT INTO todo_item_fts (todo_item_fts, rank) VALUES ('rank', 'bm25(1.0, 0.0)')"))
+        conn.execute(text("INSERT INTO todo_item_fts (todo_item_fts) VALUES ('rebuild')"))
+
+# Counters of existing lists and items are computed once here and kept up to
+# date by every write from then on
+@migration(6, 'progress counters')
+def add_progress_counters():
+    for table in ('todo_list', 'todo_item'):
+        if 'total_count' not in _columns(table):
+            with db.engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE {table} ADD COLUMN total_count INTEGER NOT NULL DEFAULT 0'))
+                conn.execute(text(f'ALTER TABLE {table} ADD COLUMN completed_count INTEGER NOT NULL DEFAULT 0'))
+
+    check_counts(repair=True)
+
+# SQLite can only switch a table to AUTOINCREMENT by rebuilding it. Foreign
+# keys are not enforced on these connections, so the items keep pointing at
+# 'todo_list' while it is dropped and the copy renamed into its place.
+@migration(7, 'never reuse list ids')
+def add_list_autoincrement():
+    with db.engine.begin() as conn:
+        schema = conn.execute(text(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'todo_list'"
+        )).scalar()
+        if 'AUTOINCREMENT' in schema.upper():
+            return
+
+        metadata = MetaData()
+        User.__table__.to_metadata(metadata)
+        copy = TodoList.__table__.to_metadata(metadata, name='todo_list_new')
+        columns = ', '.join(column.name for column in TodoList.__table__.columns)
+
+        conn.execute(CreateTable(copy))
+        conn.execute(text(f'INSERT INTO todo_list_new ({columns}) SELECT {columns} FROM todo_list'))
+        conn.execute(text('DROP TABLE todo_list'))
+        conn.execute(text('ALTER TABLE todo_list_new RENAME TO todo_list'))
+        for index in TodoList.__table__.indexes:
+            index.create(conn)
+
+def current_version():
+    with db.engine.connect() as conn:
+        return conn.execute(text('PRAGMA user_version')).scalar()
+
+def migrate():
+    version = current_version()
+    applied = []
+
+    for target, description, fn in sorted(MIGRATIONS, key=lambda entry: entry[0]):
+        if target <= version:
+            continue
+        fn()
+        db.session.commit()
+        with db.engine.begin() as conn:
+            conn.execute(text(f'PRAGMA user_version = {int(target)}'))
+        version = target
+        applied.append((target, description))
+
+    return applied
@@ -19,9 +19,23 @@ class TodoList(db.Model):
     name = db.Column(db.String(100), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # Bumped once by every transaction that changes the list's items
+    revision = db.Column(db.Integer, default=0, nullable=False)
+    # Tombstones up to this revision have been compacted away
+    compacted_revision = db.Column(db.Integer, default=0, nullable=False)
+    # Items in the list and how many of them are complete
+    total_count = db.Column(db.Integer, default=0, nullable=False)
+    completed_count = db.Column(db.Integer, default=0, nullable=False)
     
     items = db.relationship('TodoItem', backref='list', lazy=True, cascade='all, delete-orphan')
     
+    # AUTOINCREMENT keeps SQLite from handing a deleted list's id to a new
+    # list, which would then match the old list's ETags and change positions
+    __table_args__ = (
+        db.Index('ix_todo_list_user_id', 'user_id', 'id'),
+        {'sqlite_autoincrement': True}
+    )
+    
     def __repr__(self):
         return f'<TodoList {self.name}>'
 
@@ -34,8 +48,38 @@ class TodoItem(db.Model):
     
     list_id = db.Column(db.Integer, db.ForeignKey('todo_list.id'), nullable=False)
     parent_id = db.Column(db.Integer, db.ForeignKey('todo_item.id'), nullable=True)
+    # Materialized path of ancestor ids including this item, e.g. '/1/5/12/'.
+    # A subtree is a contiguous range of this index (see tree.subtree_filter).
+    path = db.Column(db.Text, index=True)
+    # Descendants of the item and how many of them are complete
+    total_count = db.Column(db.Integer, default=0, nullable=False)
+    completed_count = db.Column(db.Integer, default=0, nullable=False)
     
     children = db.relationship('TodoItem', backref=db.backref('parent', remote_side=[id]), lazy=True, cascade='all, delete-orphan')
     
+    __table_args__ = (
+        db.Index('ix_todo_item_list_id', 'list_id', 'id'),
+        db.Index('ix_todo_item_parent_id', 'parent_id'),
+    )
+    
     def __repr__(self):
         return f'<TodoItem {self.text}>'
+
+# Change log of a list's items, one row per item holding the revision of the
+# item's latest change. Deleted and moved-out items keep a tombstone row until
+# they are compacted.
+class ItemChange(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    list_id = db.Column(db.Integer, db.ForeignKey('todo_list.id'), nullable=False)
+    item_id = db.Column(db.Integer, nullable=False)
+    revision = db.Column(db.Integer, nullable=False)
+    deleted = db.Column(db.Boolean, default=False, nullable=False)
+    
+    __table_args__ = (
+        db.UniqueConstraint('list_id', 'item_id'),
+        db.Index('ix_item_change_list_revision', 'list_id', 'revision'),
+        db.Index('ix_item_change_list_deleted_revision', 'list_id', 'deleted', 'revision'),
+    )
+    
+    def __repr__(self):
+        return f'<ItemChange {self.list_id}:{self.item_id}@{self.revision}>'
@@ -0,0 +1,59 @@
+from sqlalchemy import select, table, column, literal_column
+
+from models import db, TodoList, TodoItem
+from tree import fetch_ancestors
+
+# Words of a query beyond this are ignored
+MAX_SEARCH_TERMS = 16
+
+# Largest page of results a client may ask for
+MAX_SEARCH_RESULTS = 100
+
+# The FTS5 index created by the search migration
+todo_item_fts = table('todo_item_fts', column('rowid'), column('rank'))
+
+
+# Turns free text into an FTS5 query over the given lists. Every word is
+# quoted, so FTS5 syntax typed by the user is searched for literally, and the
+# last word also matches as a prefix so results can follow the user's typing.
+def match_expression(query, list_ids):
+    terms = [term for term in query.split() if any(char.isalnum() for char in term)][:MAX_SEARCH_TERMS]
+    if not terms:
+        return None
+
+    phrases = ['"' + term.replace('"', '""') + '"' for term in terms]
+    if len(terms[-1]) >= 2:
+        phrases[-1] += '*'
+
+    lists = ' OR '.join(f'l{list_id}' for list_id in list_ids)
+    return f'list_key : ({lists}) AND text : ({" ".join(phrases)})'
+
+# Best matches first among the user's items, each with its list and the
+# chain of ancestors from the root down to its parent
+def search_items(user_id, query, limit, offset=0):
+    lists = dict(db.session.execute(
+        select(TodoList.id, TodoList.name).where(TodoList.user_id == user_id)
+    ).all())
+    expression = match_expression(query, lists)
+    if not lists or expression is None:
+        return []
+
+    items = db.session.scalars(
+        select(TodoItem)
+        .join(todo_item_fts, todo_item_fts.c.rowid == TodoItem.id)
+        .where(literal_column('todo_item_fts').op('MATCH')(expression), TodoItem.list_id.in_(lists))
+        .order_by(todo_item_fts.c.rank)
+        .limit(limit)
+        .offset(offset)
+    ).all()
+
+    ancestors = fetch_ancestors(items)
+
+    return [{
+        'id': item.id,
+        'text': item.text,
+        'is_complete': item.is_complete,
+        'parent_id': item.parent_id,
+        'list': {'id': item.list_id, 'name': lists[item.list_id]},
+        'ancestors': [{'id': ancestor.id, 'text': ancestor.text} for ancestor in ancestors[item.id]]
+    } for item in items]
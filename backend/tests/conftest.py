@@ -0,0 +1,69 @@
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The app reads its configuration at import time, so the test database and
+# the cheap test settings have to be in place before it is imported
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+os.environ['AUTH_ATTEMPTS_PER_USERNAME'] = '1000000'
+os.environ['AUTH_ATTEMPTS_PER_IP'] = '1000000'
+os.environ['TRUSTED_PROXIES'] = '1'
+os.environ['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+os.environ['PASSWORD_HASH_WORKERS'] = '0'
+
+from app import app as flask_app
+from models import db
+from cache import tree_cache
+
+
+@pytest.fixture
+def app():
+    flask_app.config['TESTING'] = True
+    flask_app.config['SESSION_COOKIE_SECURE'] = False
+    yield flask_app
+
+    # Empty every table; the search index follows through its triggers
+    with flask_app.app_context():
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
+    tree_cache.clear()
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    client.post('/api/register', json={'username': 'alice', 'password': 'secret'})
+    client.post('/api/login', json={'username': 'alice', 'password': 'secret'})
+    return client
+
+
+@pytest.fixture
+def make_list(client):
+    def make(name='Todo'):
+        return client.post('/api/lists', json={'name': name}).get_json()['list']['id']
+    return make
+
+
+@pytest.fixture
+def make_item(client):
+    def make(list_id, text='item', parent_id=None):
+        response = client.post(f'/api/lists/{list_id}/items', json={'text': text, 'parent_id': parent_id})
+        return response.get_json()['item']['id']
+    return make
+
+
+# Import a tree of `size` items where every item has up to `fanout` children
+@pytest.fixture
+def import_tree(client):
+    def make(list_id, size, fanout=4):
+        lines = [json.dumps({'id': n, 'parent_id': (n - 1) // fanout if n else None, 'text': f'item {n}'})
+                 for n in range(size)]
+        response = client.post(f'/api/lists/{list_id}/import', data='\n'.join(lines))
+        assert response.status_code == 201
+    return make
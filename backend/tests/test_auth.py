@@ -0,0 +1,118 @@
+import pytest
+from werkzeug.security import generate_password_hash
+
+from app import username_throttle, ip_throttle
+from hashing import hasher, canonical_method, PasswordHasher
+from models import User
+
+
+@pytest.fixture(autouse=True)
+def throttles():
+    yield
+    username_throttle.reset()
+    ip_throttle.reset()
+
+
+def login(client, username='alice', password='wrong', ip='203.0.113.1'):
+    return client.post('/api/login', json={'username': username, 'password': password},
+                       headers={'X-Forwarded-For': ip})
+
+
+def test_ip_throttle_uses_the_forwarded_client_address(app, monkeypatch):
+    monkeypatch.setattr(ip_throttle, 'limit', 1)
+    client = app.test_client()
+
+    assert login(client, ip='203.0.113.1').status_code == 401
+    assert login(client, ip='203.0.113.2').status_code == 401
+    assert login(client, ip='203.0.113.1').status_code == 429
+
+
+@pytest.fixture
+def hash_calls(monkeypatch):
+    calls = []
+
+    def counted(name):
+        original = getattr(hasher, name)
+        def call(*args):
+            calls.append(name)
+            return original(*args)
+        return call
+
+    for name in ('hash', 'verify'):
+        monkeypatch.setattr(hasher, name, counted(name))
+    return calls
+
+
+def test_username_limit_returns_429_without_hashing(app, client, monkeypatch, hash_calls):
+    monkeypatch.setattr(username_throttle, 'limit', 2)
+    username_throttle.reset()
+
+    assert login(client, ip='203.0.113.1').status_code == 401
+    assert login(client, ip='203.0.113.2').status_code == 401
+    hash_calls.clear()
+    response = login(client, password='secret', ip='203.0.113.3')
+
+    assert response.status_code == 429
+    assert 1 <= int(response.headers['Retry-After']) <= app.config['AUTH_ATTEMPTS_WINDOW'] + 1
+    assert hash_calls == []
+    # Other usernames are not affected
+    assert login(client, username='bob', ip='203.0.113.3').status_code == 401
+
+
+def test_ip_limit_returns_429_without_hashing(app, monkeypatch, hash_calls):
+    monkeypatch.setattr(ip_throttle, 'limit', 2)
+    client = app.test_client()
+
+    assert login(client, username='bob').status_code == 401
+    assert login(client, username='carol').status_code == 401
+    hash_calls.clear()
+    register = client.post('/api/register', json={'username': 'dave', 'password': 'secret'},
+                           headers={'X-Forwarded-For': '203.0.113.1'})
+
+    assert register.status_code == 429
+    assert 'Retry-After' in register.headers
+    assert hash_calls == []
+
+
+def test_login_rehashes_when_the_method_changes(app, client, monkeypatch):
+    monkeypatch.setattr(hasher, 'method', 'pbkdf2:sha256:2000')
+
+    assert login(client, password='secret').status_code == 200
+    with app.app_context():
+        assert User.query.filter_by(username='alice').one().password.startswith('pbkdf2:sha256:2000$')
+
+    # The upgraded hash still verifies the password
+    assert login(client, password='secret').status_code == 200
+
+
+def test_canonical_method_fills_in_default_parameters():
+    assert canonical_method('scrypt') == 'scrypt:32768:8:1'
+    assert canonical_method('scrypt:16384') == 'scrypt:16384:8:1'
+    assert canonical_method('pbkdf2') == 'pbkdf2:sha256:600000'
+    assert canonical_method('pbkdf2:sha256:1000') == 'pbkdf2:sha256:1000'
+
+
+def test_needs_rehash_compares_default_and_explicit_parameters():
+    pwhash = generate_password_hash('secret', 'pbkdf2:sha256:1000')
+
+    assert not PasswordHasher('pbkdf2:sha256:1000').needs_rehash(pwhash)
+    assert PasswordHasher('pbkdf2:sha256:2000').needs_rehash(pwhash)
+    assert PasswordHasher('pbkdf2').needs_rehash(pwhash)
+    assert not PasswordHasher('pbkdf2').needs_rehash('pbkdf2:sha256:600000$salt$hash')
+    assert not PasswordHasher('scrypt').needs_rehash('scrypt:32768:8:1$salt$hash')
+
+
+def test_login_returns_503_when_the_hasher_is_full(client, monkeypatch):
+    busy = PasswordHasher('pbkdf2:sha256:1000', workers=1, max_pending=1)
+    busy.hash('start the pool')
+    busy.slots.acquire()
+    monkeypatch.setattr('app.hasher', busy)
+
+    try:
+        response = login(client, password='secret')
+    finally:
+        busy.slots.release()
+        busy.shutdown()
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
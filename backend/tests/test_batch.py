@@ -0,0 +1,50 @@
+def test_batch_creates_nested_items_by_temp_id(client, make_list):
+    list_id = make_list()
+
+    response = client.post('/api/batch', json={'operations': [
+        {'op': 'create', 'list_id': list_id, 'text': 'parent', 'temp_id': 'p'},
+        {'op': 'create', 'list_id': list_id, 'text': 'child', 'parent_id': 'p'},
+        {'op': 'update', 'id': 'p', 'is_complete': True}
+    ]})
+
+    assert response.status_code == 200
+    items = client.get(f'/api/lists/{list_id}/items').get_json()['items']
+    assert items[0]['is_complete'] is True
+    assert items[0]['children'][0]['text'] == 'child'
+    assert items[0]['children'][0]['is_complete'] is True
+
+
+def test_batch_rolls_back_on_failure(client, make_list):
+    list_id = make_list()
+
+    response = client.post('/api/batch', json={'operations': [
+        {'op': 'create', 'list_id': list_id, 'text': 'kept?'},
+        {'op': 'delete', 'id': 999999}
+    ]})
+
+    assert response.status_code == 404
+    assert response.get_json()['index'] == 1
+    assert client.get(f'/api/lists/{list_id}/items').get_json()['items'] == []
+
+
+def test_batch_body_must_be_an_object(client):
+    response = client.post('/api/batch', json=[1])
+
+    assert response.status_code == 400
+
+
+def test_batch_rejects_boolean_ids(client, make_list, make_item):
+    list_id = make_list()
+    item_id = make_item(list_id, 'original')
+
+    for operation in (
+        {'op': 'update', 'id': True, 'text': 'changed'},
+        {'op': 'create', 'list_id': True, 'text': 'new'},
+        {'op': 'create', 'list_id': list_id, 'text': 'new', 'parent_id': True},
+        {'op': 'move', 'id': item_id, 'target_list_id': True}
+    ):
+        response = client.post('/api/batch', json={'operations': [operation]})
+        assert response.status_code == 404, operation
+
+    items = client.get(f'/api/lists/{list_id}/items').get_json()['items']
+    assert [item['text'] for item in items] == ['original']
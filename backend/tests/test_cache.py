@@ -0,0 +1,119 @@
+import json
+
+import pytest
+from sqlalchemy import text
+
+from models import db
+
+
+def fetch(client, list_id, etag=None):
+    headers = {'If-None-Match': f'"{etag}"'} if etag else {}
+    return client.get(f'/api/lists/{list_id}/items', headers=headers)
+
+
+def etag_of(response):
+    return response.get_etag()[0]
+
+
+@pytest.fixture
+def tree(client, make_list, make_item):
+    list_id = make_list('Source')
+    root = make_item(list_id, 'root')
+    child = make_item(list_id, 'child', root)
+    return {'list_id': list_id, 'root': root, 'child': child, 'target': make_list('Target')}
+
+
+def assert_changed(client, list_id, etag, old_body):
+    response = fetch(client, list_id, etag)
+    assert response.status_code == 200
+    assert etag_of(response) != etag
+    assert response.get_json() != old_body
+    return response
+
+
+def test_unchanged_list_answers_304(client, tree):
+    first = fetch(client, tree['list_id'])
+
+    again = fetch(client, tree['list_id'], etag_of(first))
+
+    assert again.status_code == 304
+    assert etag_of(again) == etag_of(first)
+
+
+def test_repeated_reads_are_served_from_the_cache(client, tree):
+    first = fetch(client, tree['list_id'])
+    second = fetch(client, tree['list_id'])
+
+    assert second.get_data() == first.get_data()
+    assert etag_of(second) == etag_of(first)
+
+
+MUTATIONS = {
+    'create': lambda client, tree: client.post(f"/api/lists/{tree['list_id']}/items",
+                                               json={'text': 'new', 'parent_id': tree['child']}),
+    'update_text': lambda client, tree: client.patch(f"/api/items/{tree['child']}", json={'text': 'renamed'}),
+    'complete': lambda client, tree: client.patch(f"/api/items/{tree['root']}", json={'is_complete': True}),
+    'delete': lambda client, tree: client.delete(f"/api/items/{tree['child']}"),
+    'move': lambda client, tree: client.post(f"/api/items/{tree['child']}/move",
+                                             json={'target_list_id': tree['target']}),
+    'batch': lambda client, tree: client.post('/api/batch', json={'operations': [
+        {'op': 'create', 'list_id': tree['list_id'], 'text': 'batched', 'parent_id': tree['root']}
+    ]}),
+    'import': lambda client, tree: client.post(f"/api/lists/{tree['list_id']}/import",
+                                               data=json.dumps({'id': 1, 'text': 'imported'}) + '\n')
+}
+
+
+@pytest.mark.parametrize('mutation', sorted(MUTATIONS))
+def test_mutations_invalidate_the_tree(client, tree, mutation):
+    before = fetch(client, tree['list_id'])
+    assert fetch(client, tree['list_id'], etag_of(before)).status_code == 304
+
+    response = MUTATIONS[mutation](client, tree)
+    assert response.status_code < 300
+
+    after = assert_changed(client, tree['list_id'], etag_of(before), before.get_json())
+    assert fetch(client, tree['list_id'], etag_of(after)).status_code == 304
+
+
+def test_move_invalidates_the_target_list(client, tree):
+    before = fetch(client, tree['target'])
+
+    client.post(f"/api/items/{tree['child']}/move", json={'target_list_id': tree['target']})
+
+    after = assert_changed(client, tree['target'], etag_of(before), before.get_json())
+    assert [item['text'] for item in after.get_json()['items']] == ['child']
+
+
+def test_deleted_list_etag_never_matches_a_new_list(client, make_list, make_item):
+    list_id = make_list('Old')
+    make_item(list_id, 'old item')
+    before = fetch(client, list_id)
+
+    assert client.delete(f'/api/lists/{list_id}').status_code == 200
+    assert fetch(client, list_id, etag_of(before)).status_code == 404
+
+    new_list_id = make_list('New')
+    make_item(new_list_id, 'new item')
+    assert new_list_id != list_id
+
+    response = fetch(client, new_list_id, etag_of(before))
+    assert response.status_code == 200
+    assert response.get_json()['items'][0]['text'] == 'new item'
+
+
+def test_repairing_counters_invalidates_the_tree(app, client, tree):
+    before = fetch(client, tree['list_id'])
+
+    # Drift the stored counter behind the app's back
+    with app.app_context():
+        db.session.execute(text('UPDATE todo_item SET total_count = 7 WHERE id = :id'), {'id': tree['root']})
+        db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['check-counts', '--repair'])
+    assert 'Repaired' in result.output
+
+    after = fetch(client, tree['list_id'], etag_of(before))
+    assert after.status_code == 200
+    assert etag_of(after) != etag_of(before)
+    assert after.get_json()['items'][0]['total_count'] == 1
@@ -0,0 +1,37 @@
+def changes(client, list_id, since):
+    return client.get(f'/api/lists/{list_id}/changes?since={since}').get_json()
+
+
+def test_changes_since_a_revision(client, make_list, make_item):
+    list_id = make_list()
+    kept = make_item(list_id, 'kept')
+    doomed = make_item(list_id, 'doomed')
+    revision = changes(client, list_id, 0)['revision']
+
+    client.patch(f'/api/items/{kept}', json={'text': 'edited'})
+    client.delete(f'/api/items/{doomed}')
+
+    delta = changes(client, list_id, revision)
+    assert delta['reset'] is False
+    assert [item['text'] for item in delta['upserted']] == ['edited']
+    assert delta['deleted'] == [doomed]
+    assert delta['revision'] == revision + 2
+
+
+def test_revision_ahead_of_the_list_resets(client, make_list, make_item):
+    list_id = make_list()
+    make_item(list_id)
+    revision = changes(client, list_id, 0)['revision']
+
+    assert changes(client, list_id, revision)['reset'] is False
+    assert changes(client, list_id, revision + 1)['reset'] is True
+
+
+def test_deleted_list_position_does_not_carry_over(client, make_list, make_item):
+    list_id = make_list()
+    make_item(list_id)
+    make_item(list_id)
+    client.delete(f'/api/lists/{list_id}')
+
+    assert client.get(f'/api/lists/{list_id}/changes?since=2').status_code == 404
+    assert make_list() != list_id
@@ -0,0 +1,60 @@
+import threading
+
+from tree import check_counts
+
+
+def login(app, username):
+    client = app.test_client()
+    client.post('/api/register', json={'username': username, 'password': 'secret'})
+    client.post('/api/login', json={'username': username, 'password': 'secret'})
+    return client
+
+
+def test_counters_follow_creates_completes_moves_and_deletes(client, make_list, make_item):
+    source = make_list('Source')
+    target = make_list('Target')
+    root = make_item(source, 'root')
+    child = make_item(source, 'child', root)
+    make_item(source, 'grandchild', child)
+
+    client.patch(f'/api/items/{child}', json={'is_complete': True})
+    items = client.get(f'/api/lists/{source}/items').get_json()
+    assert (items['total_count'], items['completed_count']) == (3, 2)
+    assert (items['items'][0]['total_count'], items['items'][0]['completed_count']) == (2, 2)
+
+    client.post(f'/api/items/{child}/move', json={'target_list_id': target})
+    lists = {lst['id']: lst for lst in client.get('/api/lists').get_json()['lists']}
+    assert (lists[source]['total_count'], lists[source]['completed_count']) == (1, 0)
+    assert (lists[target]['total_count'], lists[target]['completed_count']) == (2, 2)
+
+    client.delete(f'/api/items/{child}')
+    lists = {lst['id']: lst for lst in client.get('/api/lists').get_json()['lists']}
+    assert (lists[target]['total_count'], lists[target]['completed_count']) == (0, 0)
+
+
+def test_concurrent_writers_keep_counters_consistent(app, make_list, make_item):
+    list_id = make_list()
+    root = make_item(list_id, 'root')
+    errors = []
+
+    def writer(n):
+        client = login(app, 'alice')
+        try:
+            for step in range(15):
+                if (n + step) % 3:
+                    response = client.post(f'/api/lists/{list_id}/items', json={'text': 'x', 'parent_id': root})
+                else:
+                    response = client.patch(f'/api/items/{root}', json={'is_complete': step % 2 == 0})
+                assert response.status_code < 300, response.get_json()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    with app.app_context():
+        assert check_counts() == ({}, {})
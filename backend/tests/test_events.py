@@ -0,0 +1,51 @@
+import pytest
+
+from events import EventBroker, TooManyStreams, format_event
+
+
+def test_streams_are_capped_per_user_and_in_total():
+    broker = EventBroker(max_per_user=2, max_streams=3)
+    first = broker.subscribe(1, 10)
+    broker.subscribe(1, 10)
+
+    with pytest.raises(TooManyStreams):
+        broker.subscribe(1, 11)
+
+    broker.subscribe(2, 12)
+    with pytest.raises(TooManyStreams):
+        broker.subscribe(3, 13)
+
+    broker.unsubscribe(first)
+    broker.unsubscribe(first)
+    broker.subscribe(3, 13)
+    assert broker.stats() == {'streams': 3, 'lists': 3}
+
+
+def test_stream_sends_hello_then_published_events():
+    broker = EventBroker(heartbeat=0.01)
+    subscription = broker.subscribe(1, 10)
+    stream = broker.stream(subscription, 4)
+
+    assert 'event: hello' in next(stream)
+    assert next(stream) == ': ping\n\n'
+
+    broker.publish(10, format_event('changes', {'revision': 5}, 5))
+    assert next(stream) == 'id: 5\nevent: changes\ndata: {"revision":5}\n\n'
+
+    broker.publish(10, format_event('list_deleted', {}), close=True)
+    assert 'list_deleted' in next(stream)
+    with pytest.raises(StopIteration):
+        next(stream)
+    assert broker.stats()['streams'] == 0
+
+
+def test_commits_publish_changed_item_ids(client, make_list, make_item):
+    from events import broker
+
+    list_id = make_list()
+    subscription = broker.subscribe('tester', list_id)
+    try:
+        item_id = make_item(list_id)
+        assert f'"upserted":[{item_id}]' in subscription.messages.popleft()
+    finally:
+        broker.unsubscribe(subscription)
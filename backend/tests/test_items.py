@@ -0,0 +1,50 @@
+import pytest
+from sqlalchemy import event
+
+from cache import tree_cache
+from models import db
+
+
+class StatementCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __enter__(self):
+        event.listen(db.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(db.engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+@pytest.mark.parametrize('query', ['', '?format=flat'])
+def test_get_items_query_count_does_not_grow_with_the_tree(app, client, make_list, import_tree, query):
+    counts = []
+    for size in (10, 1000):
+        list_id = make_list()
+        import_tree(list_id, size)
+        tree_cache.clear()
+
+        with app.app_context(), StatementCounter() as counter:
+            response = client.get(f'/api/lists/{list_id}/items{query}')
+
+        assert response.status_code == 200
+        counts.append(counter.count)
+
+    assert counts[0] == counts[1]
+
+
+def test_get_items_nests_children(client, make_list, make_item):
+    list_id = make_list()
+    root = make_item(list_id, 'root')
+    child = make_item(list_id, 'child', root)
+    make_item(list_id, 'grandchild', child)
+
+    items = client.get(f'/api/lists/{list_id}/items').get_json()['items']
+
+    assert [item['text'] for item in items] == ['root']
+    assert items[0]['children'][0]['text'] == 'child'
+    assert items[0]['children'][0]['children'][0]['text'] == 'grandchild'
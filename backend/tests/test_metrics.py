@@ -0,0 +1,99 @@
+import logging
+import re
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from metrics import metrics
+from models import db
+
+SAMPLE = re.compile(r'([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{((?:[a-zA-Z_]\w*="[^"]*",?)*)\})? (\S+)')
+
+
+@pytest.fixture
+def fresh_metrics(monkeypatch):
+    monkeypatch.setattr(metrics, 'routes', {})
+    return metrics
+
+
+# Parses the Prometheus text format strictly enough to catch malformed lines;
+# returns {(name, labels): value}
+def parse_samples(body):
+    samples = {}
+    types = {}
+    for line in body.splitlines():
+        if line.startswith('# HELP '):
+            continue
+        if line.startswith('# TYPE '):
+            _, _, name, kind = line.split(' ')
+            assert kind in ('counter', 'gauge', 'histogram')
+            types[name] = kind
+            continue
+        match = SAMPLE.fullmatch(line)
+        assert match, line
+        name, labels, value = match.groups()
+        assert re.sub(r'_(bucket|sum|count)$', '', name) in types or name in types, line
+        samples[name, labels or ''] = float(value)
+    return samples
+
+
+def test_failed_statements_leave_nothing_on_the_connection(app):
+    with app.app_context():
+        with db.engine.connect() as connection:
+            for _ in range(3):
+                with pytest.raises(OperationalError):
+                    connection.execute(text('SELECT * FROM missing_table'))
+                connection.rollback()
+
+            assert connection.info.get('metrics_start', []) == []
+            assert connection.execute(text('SELECT 1')).scalar() == 1
+
+
+def test_metrics_render_per_route_histograms(client, make_list, make_item, fresh_metrics):
+    list_id = make_list()
+    make_item(list_id)
+    for _ in range(3):
+        client.get(f'/api/lists/{list_id}/items')
+
+    samples = parse_samples(client.get('/api/metrics').get_data(as_text=True))
+
+    labels = 'route="/api/lists/<int:list_id>/items",method="GET"'
+    for name in ('todo_http_request_duration_seconds', 'todo_db_statements_per_request'):
+        buckets = [value for (sample, sample_labels), value in samples.items()
+                   if sample == f'{name}_bucket' and sample_labels.startswith(labels)]
+        assert buckets == sorted(buckets)
+        assert buckets[-1] == samples[f'{name}_count', labels] == 3
+    assert samples['todo_db_statements_per_request_sum', labels] >= 3
+    assert samples['todo_db_seconds_total', labels] > 0
+    assert ('todo_db_statements_per_request_count', 'route="/api/lists/<int:list_id>/items",method="POST"') in samples
+
+
+def test_metrics_token_is_required_when_set(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'METRICS_TOKEN', 'scrape-me')
+    client = app.test_client()
+
+    assert client.get('/api/metrics').status_code == 401
+    assert client.get('/api/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    assert client.get('/api/metrics', headers={'Authorization': 'Bearer scrape-me'}).status_code == 200
+
+
+def test_server_timing_only_when_enabled(client, monkeypatch):
+    assert 'Server-Timing' not in client.get('/api/lists').headers
+
+    monkeypatch.setattr(metrics, 'server_timing', True)
+    timings = client.get('/api/lists').headers.getlist('Server-Timing')
+
+    assert timings[0].startswith('app;dur=')
+    assert re.fullmatch(r'db;dur=[0-9.]+;desc="[1-9][0-9]* queries"', timings[1])
+
+
+def test_slow_queries_are_counted_and_logged(client, monkeypatch, caplog):
+    monkeypatch.setattr(metrics, 'slow_query_ms', 0)
+    slow_queries = metrics.slow_queries
+
+    with caplog.at_level(logging.WARNING, logger='todo.slow_queries'):
+        client.get('/api/lists')
+
+    assert metrics.slow_queries > slow_queries
+    assert any('in /api/lists: SELECT' in record.getMessage() for record in caplog.records)
@@ -0,0 +1,24 @@
+def test_search_returns_hits_with_their_ancestors(client, make_list, make_item):
+    list_id = make_list('Groceries')
+    dairy = make_item(list_id, 'Dairy')
+    eggs = make_item(list_id, 'buy milk and eggs', dairy)
+    make_item(list_id, 'whole milk', eggs)
+    make_item(list_id, 'bread')
+
+    results = client.get('/api/search?q=milk').get_json()['results']
+
+    assert {hit['text'] for hit in results} == {'buy milk and eggs', 'whole milk'}
+    whole_milk = next(hit for hit in results if hit['text'] == 'whole milk')
+    assert [ancestor['text'] for ancestor in whole_milk['ancestors']] == ['Dairy', 'buy milk and eggs']
+    assert whole_milk['list'] == {'id': list_id, 'name': 'Groceries'}
+
+
+def test_search_only_sees_the_users_own_lists(app, client, make_list, make_item):
+    make_item(make_list(), 'secret plan')
+
+    other = app.test_client()
+    other.post('/api/register', json={'username': 'bob', 'password': 'secret'})
+    other.post('/api/login', json={'username': 'bob', 'password': 'secret'})
+
+    assert other.get('/api/search?q=secret').get_json()['results'] == []
+    assert len(client.get('/api/search?q=secret').get_json()['results']) == 1
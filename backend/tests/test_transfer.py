@@ -0,0 +1,117 @@
+import json
+import sqlite3
+
+from models import db
+
+
+# Like gunicorn's request body: read(size) and nothing else
+class BodyStream:
+    def __init__(self, data):
+        self.data = data
+
+    def read(self, size=-1):
+        if size < 0:
+            size = len(self.data)
+        chunk, self.data = self.data[:size], self.data[size:]
+        return chunk
+
+
+def test_import_reads_a_stream_without_readable(client, make_list):
+    list_id = make_list()
+    body = '\n'.join(json.dumps({'id': n, 'parent_id': n - 1 if n else None, 'text': f'item {n}'})
+                     for n in range(3)).encode()
+
+    response = client.post(f'/api/lists/{list_id}/import', environ_overrides={
+        'wsgi.input': BodyStream(body),
+        'wsgi.input_terminated': True
+    })
+
+    assert response.status_code == 201
+    assert response.get_json()['imported'] == 3
+    items = client.get(f'/api/lists/{list_id}/items').get_json()['items']
+    assert items[0]['children'][0]['children'][0]['text'] == 'item 2'
+
+
+# Another connection writes while the body is still being read
+class WritingBodyStream(BodyStream):
+    def read(self, size=-1):
+        connection = sqlite3.connect(db.engine.url.database, timeout=0)
+        try:
+            connection.execute('UPDATE todo_list SET name = name')
+            connection.commit()
+        finally:
+            connection.close()
+        return super().read(size)
+
+
+def test_import_reads_the_body_before_taking_the_write_lock(client, make_list):
+    list_id = make_list()
+    body = json.dumps({'id': 1, 'text': 'item'}).encode()
+
+    response = client.post(f'/api/lists/{list_id}/import', environ_overrides={
+        'wsgi.input': WritingBodyStream(body),
+        'wsgi.input_terminated': True
+    })
+
+    assert response.status_code == 201
+
+
+def outline(items):
+    return [(item['text'], item['is_complete'], outline(item['children'])) for item in items]
+
+
+def test_export_then_import_keeps_nesting_and_completion(client, make_list, make_item):
+    source = make_list('Source')
+    root = make_item(source, 'root')
+    child = make_item(source, 'child', root)
+    grandchild = make_item(source, 'grandchild', child)
+    make_item(source, 'second root')
+    client.patch(f'/api/items/{grandchild}', json={'is_complete': True})
+
+    exported = client.get(f'/api/lists/{source}/export').get_data()
+    target = make_list('Target')
+    response = client.post(f'/api/lists/{target}/import', data=exported)
+
+    assert response.status_code == 201
+    assert response.get_json()['imported'] == 4
+    assert outline(client.get(f'/api/lists/{target}/items').get_json()['items']) == [
+        ('root', False, [('child', False, [('grandchild', True, [])])]),
+        ('second root', False, [])
+    ]
+
+
+def test_import_reports_the_line_of_an_invalid_item(client, make_list):
+    list_id = make_list()
+    valid = json.dumps({'id': 1, 'text': 'root'})
+    cases = [
+        ('{"id": 2, "text": ', 'Invalid JSON'),
+        (json.dumps({'id': 1, 'text': 'again'}), 'Duplicate item id'),
+        (json.dumps({'id': 2, 'parent_id': 3, 'text': 'orphan'}), 'Parent item must come before its children')
+    ]
+
+    for line, message in cases:
+        response = client.post(f'/api/lists/{list_id}/import', data='\n'.join([valid, '', line]))
+
+        assert response.status_code == 400
+        assert response.get_json() == {'message': message, 'line': 3}
+
+    # Nothing from a rejected import is kept
+    assert client.get(f'/api/lists/{list_id}/items').get_json()['items'] == []
+
+
+def test_import_links_children_across_chunks(client, make_list, monkeypatch):
+    monkeypatch.setattr('transfer.IMPORT_CHUNK_SIZE', 3)
+    list_id = make_list()
+    body = '\n'.join(json.dumps({'id': f'n{n}', 'parent_id': f'n{n - 1}' if n else None, 'text': f'item {n}'})
+                     for n in range(8))
+
+    response = client.post(f'/api/lists/{list_id}/import', data=body)
+
+    assert response.status_code == 201
+    items = client.get(f'/api/lists/{list_id}/items').get_json()['items']
+    depth = 0
+    while items:
+        assert [item['text'] for item in items] == [f'item {depth}']
+        items = items[0]['children']
+        depth += 1
+    assert depth == 8
@@ -0,0 +1,43 @@
+from collections import deque
+import threading
+import time
+
+
+# Sliding-window limiter allowing `limit` hits per key within `window`
+# seconds. Keys that have gone quiet are swept once the table grows past
+# max_keys, so a flood of distinct keys cannot grow it without bound.
+class Throttle:
+    def __init__(self, limit, window, max_keys=100000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self.hits = {}
+        self.lock = threading.Lock()
+
+    # Records a hit and returns 0 if it is allowed, otherwise the number of
+    # seconds until the key may try again
+    def hit(self, key):
+        now = time.monotonic()
+        with self.lock:
+            hits = self.hits.get(key)
+            if hits is None:
+                if len(self.hits) >= self.max_keys:
+                    self._sweep(now)
+                hits = self.hits[key] = deque()
+
+            while hits and hits[0] <= now - self.window:
+                hits.popleft()
+
+            if len(hits) >= self.limit:
+                return hits[0] + self.window - now
+
+            hits.append(now)
+            return 0
+
+    def _sweep(self, now):
+        for key in [key for key, hits in self.hits.items() if not hits or hits[-1] <= now - self.window]:
+            del self.hits[key]
+
+    def reset(self):
+        with self.lock:
+            self.hits.clear()
@@ -0,0 +1,130 @@
+import json
+import tempfile
+
+from tree import iter_list_items, bulk_create_tree
+
+# Items inserted per round of bulk INSERTs during an import
+IMPORT_CHUNK_SIZE = 1000
+
+# Size up to which a checked import is spooled in memory rather than on disk
+SPOOL_MEMORY_SIZE = 8 * 1024 * 1024
+
+
+class ImportFailed(Exception):
+    def __init__(self, line, message):
+        super().__init__(message)
+        self.line = line
+        self.message = message
+
+
+# Bytes read from the request body at a time while splitting it into lines
+READ_SIZE = 64 * 1024
+
+
+# Split a byte stream into lines. Only read(size) is used, which every WSGI
+# server's input supports; gunicorn's, for one, is not an io.RawIOBase.
+def iter_lines(stream):
+    pending = b''
+    while True:
+        data = stream.read(READ_SIZE)
+        if not data:
+            break
+        lines = (pending + data).split(b'\n')
+        pending = lines.pop()
+        yield from lines
+    if pending:
+        yield pending
+
+# One JSON object per item and line, parents before their children
+def export_lines(list_id):
+    for row in iter_list_items(list_id):
+        yield json.dumps({
+            'id': row.id,
+            'parent_id': row.parent_id,
+            'text': row.text,
+            'is_complete': bool(row.is_complete)
+        }) + '\n'
+
+# Reads items in the export format from an iterable of lines, checks them and
+# spools them to a temporary file, in memory up to SPOOL_MEMORY_SIZE. Nothing
+# touches the database, so a slow upload holds no lock. A parent must come
+# before its children. Raises ImportFailed on the first invalid line; returns
+# the spool, rewound, and the number of items.
+def spool_import(lines):
+    seen = set()
+    count = 0
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_SIZE, mode='w+')
+
+    try:
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+
+            try:
+                data = json.loads(line)
+            except ValueError:
+                raise ImportFailed(number, 'Invalid JSON')
+
+            if not isinstance(data, dict) or not data.get('text') or not isinstance(data['text'], str):
+                raise ImportFailed(number, 'Item text is required')
+
+            source_id = data.get('id')
+            parent_source_id = data.get('parent_id')
+            if not all(ref is None or (isinstance(ref, (int, str)) and not isinstance(ref, bool))
+                       for ref in (source_id, parent_source_id)):
+                raise ImportFailed(number, 'Item ids must be numbers or strings')
+            if source_id is not None and source_id in seen:
+                raise ImportFailed(number, 'Duplicate item id')
+            if parent_source_id is not None and parent_source_id not in seen:
+                raise ImportFailed(number, 'Parent item must come before its children')
+
+            if source_id is not None:
+                seen.add(source_id)
+            spool.write(json.dumps([source_id, parent_source_id, data['text'], bool(data.get('is_complete'))]) + '\n')
+            count += 1
+    except BaseException:
+        spool.close()
+        raise
+
+    spool.seek(0)
+    return spool, count
+
+# Inserts the items of a spool from spool_import into the list in chunks. The
+# ids in the input only link children to their parents and are mapped to the
+# new ids as the items are inserted. Runs inside the caller's transaction.
+def import_spooled(list_id, spool):
+    imported = {}
+    chunk = []
+
+    # Once inserted, only the new id and path of an item are kept around for
+    # its children
+    def flush():
+        bulk_create_tree(chunk)
+        for row in chunk:
+            if row['source_id'] is not None:
+                imported[row['source_id']] = {'id': row['id'], 'path': row['path']}
+        chunk.clear()
+
+    for line in spool:
+        source_id, parent_source_id, text, is_complete = json.loads(line)
+        row = {'source_id': source_id, 'text': text, 'list_id': list_id,
+               'is_complete': is_complete,
+               'parent_id': None, 'parent_path': None, 'parent_row': None}
+
+        if parent_source_id is not None:
+            parent_row = imported[parent_source_id]
+            if 'id' in parent_row:
+                row['parent_id'] = parent_row['id']
+                row['parent_path'] = parent_row['path']
+            else:
+                row['parent_row'] = parent_row
+
+        if source_id is not None:
+            imported[source_id] = row
+        chunk.append(row)
+
+        if len(chunk) >= IMPORT_CHUNK_SIZE:
+            flush()
+
+    if chunk:
+        flush()
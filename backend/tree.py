@@ -0,0 +1,393 @@
+from sqlalchemy import select, insert, update, delete, and_, or_, case, func, literal, cast, bindparam
+from sqlalchemy.orm import aliased
+from datetime import datetime
+from models import db, TodoList, TodoItem
+from changes import current_revision, record_items, record_matching
+from database import begin_write
+
+
+# Every item stores the ids of its ancestors and itself as a path such as
+# '/1/5/12/'. All descendants of an item share its path as a prefix, so a
+# subtree is the index range [path, path with its trailing '/' bumped to '0').
+# '0' is the first character after '/', so '/1/50/' falls outside '/1/5/'.
+def subtree_filter(path):
+    return and_(TodoItem.path >= path, TodoItem.path < path[:-1] + '0')
+
+def descendants_filter(path):
+    return and_(TodoItem.path > path, TodoItem.path < path[:-1] + '0')
+
+def ancestor_ids(path):
+    return [int(part) for part in path.strip('/').split('/')[:-1]]
+
+def make_path(item_id, parent_path=None):
+    return (parent_path or '/') + f'{item_id}/'
+
+# Ancestors of several items with one query, as a dict of item id to the
+# item's ancestors from the root down to its parent
+def fetch_ancestors(items):
+    ids = {item.id: ancestor_ids(item.path) for item in items}
+    wanted = {ancestor_id for item_ids in ids.values() for ancestor_id in item_ids}
+    found = {}
+    if wanted:
+        found = {ancestor.id: ancestor for ancestor in TodoItem.query.filter(TodoItem.id.in_(wanted))}
+    return {item_id: [found[ancestor_id] for ancestor_id in item_ids if ancestor_id in found]
+            for item_id, item_ids in ids.items()}
+
+# Needs the item's id, so the caller must have flushed it already
+def assign_path(item, parent=None):
+    item.path = make_path(item.id, parent.path if parent else None)
+
+# Add to the progress counters of a list and of some of its items, given as a
+# dict of item id to a (total, completed) pair. The items are updated with one
+# executemany UPDATE that leaves updated_at alone, and recorded as changed.
+# Objects already loaded keep their old counters. The deltas are worked out
+# from loaded items, so callers load them after database.begin_write().
+def add_counts(list_id, total, completed, items=None):
+    if total or completed:
+        db.session.execute(
+            update(TodoList)
+            .where(TodoList.id == list_id)
+            .values(total_count=TodoList.total_count + total,
+                    completed_count=TodoList.completed_count + completed)
+            .execution_options(synchronize_session=False)
+        )
+
+    rows = [{'item_id': item_id, 'add_total': item_total, 'add_completed': item_completed}
+            for item_id, (item_total, item_completed) in (items or {}).items()
+            if item_total or item_completed]
+    if not rows:
+        return
+
+    table = TodoItem.__table__
+    db.session.execute(
+        update(table)
+        .where(table.c.id == bindparam('item_id'))
+        .values(total_count=table.c.total_count + bindparam('add_total'),
+                completed_count=table.c.completed_count + bindparam('add_completed'),
+                updated_at=table.c.updated_at),
+        rows
+    )
+    record_items(list_id, [row['item_id'] for row in rows])
+
+# Counters change by the same amount for the list and every ancestor on a path
+def add_counts_along(list_id, path, total, completed):
+    add_counts(list_id, total, completed,
+               {ancestor_id: (total, completed) for ancestor_id in ancestor_ids(path)})
+
+# The item with its descendants as a (total, completed) pair
+def subtree_counts(item):
+    return item.total_count + 1, item.completed_count + (1 if item.is_complete else 0)
+
+def create_item(list_id, text, parent=None):
+    item = TodoItem(text=text, list_id=list_id, parent_id=parent.id if parent else None)
+    db.session.add(item)
+    db.session.flush()
+    assign_path(item, parent)
+    record_items(list_id, [item.id])
+    add_counts_along(list_id, item.path, 1, 0)
+    return item
+
+def set_text(item, text):
+    item.text = text
+    record_items(item.list_id, [item.id])
+
+# Insert many items with one multi-row INSERT and assign all their paths with
+# one UPDATE. Each row needs 'text', 'list_id', 'parent_id' and 'parent_path';
+# the parents must already exist. Returns (id, path) pairs in the order of the
+# rows.
+def bulk_create_items(rows):
+    # SQLite does not promise RETURNING rows in VALUES order, so every row is
+    # tagged with a placeholder path that maps the returned id back to it.
+    # Placeholders start with '#', which sorts before the '/' of every real
+    # path, and are replaced before the transaction commits.
+    returned = db.session.execute(
+        insert(TodoItem.__table__).returning(TodoItem.id, TodoItem.path),
+        [{'text': row['text'], 'list_id': row['list_id'], 'parent_id': row['parent_id'],
+          'is_complete': row.get('is_complete', False), 'path': f'#{position}'}
+         for position, row in enumerate(rows)]
+    ).all()
+
+    ids = [None] * len(rows)
+    for item_id, placeholder in returned:
+        ids[int(placeholder[1:])] = item_id
+
+    placeholders = and_(TodoItem.path >= '#', TodoItem.path < '$')
+    for list_id in {row['list_id'] for row in rows}:
+        record_matching(list_id, TodoItem.list_id == list_id, placeholders)
+
+    parent = aliased(TodoItem)
+    parent_path = select(parent.path).where(parent.id == TodoItem.parent_id).scalar_subquery()
+    db.session.execute(
+        update(TodoItem)
+        .where(placeholders)
+        .values(path=func.coalesce(parent_path, '/') + cast(TodoItem.id, db.Text) + '/')
+        .execution_options(synchronize_session=False)
+    )
+
+    return [(item_id, make_path(item_id, row['parent_path'])) for item_id, row in zip(ids, rows)]
+
+# Insert rows that may be nested among themselves. A row either has
+# 'parent_id' and 'parent_path' of an existing item or a 'parent_row' that
+# comes earlier in the same list of rows. The rows are inserted one nesting
+# level at a time so every parent's id and path are known before its children
+# go in; each row gets its 'id' and 'path' filled in. The progress counters of
+# the lists and of all the rows' ancestors are updated once at the end.
+def bulk_create_tree(rows):
+    levels = {}
+    for row in rows:
+        parent_row = row.get('parent_row')
+        row['level'] = parent_row['level'] + 1 if parent_row else 0
+        levels.setdefault(row['level'], []).append(row)
+
+    for level in sorted(levels):
+        level_rows = levels[level]
+        for row in level_rows:
+            if row.get('parent_row'):
+                row['parent_id'] = row['parent_row']['id']
+                row['parent_path'] = row['parent_row']['path']
+
+        for row, (item_id, path) in zip(level_rows, bulk_create_items(level_rows)):
+            row['id'] = item_id
+            row['path'] = path
+
+    counts = {}
+    for row in rows:
+        done = 1 if row.get('is_complete') else 0
+        list_counts = counts.setdefault(row['list_id'], [0, 0, {}])
+        list_counts[0] += 1
+        list_counts[1] += done
+        for ancestor_id in ancestor_ids(row['path']):
+            total, completed = list_counts[2].get(ancestor_id, (0, 0))
+            list_counts[2][ancestor_id] = (total + 1, completed + done)
+
+    for list_id, (total, completed, items) in counts.items():
+        add_counts(list_id, total, completed, items)
+
+# Keyset-paginated iteration over a list's items in id order, so memory stays
+# constant however large the list is
+def iter_list_items(list_id, page_size=1000):
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(TodoItem.id, TodoItem.text, TodoItem.is_complete, TodoItem.parent_id)
+            .where(TodoItem.list_id == list_id, TodoItem.id > last_id)
+            .order_by(TodoItem.id)
+            .limit(page_size)
+        ).all()
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1].id
+
+# Move an item and all of its descendants to the top level of another list,
+# rewriting the subtree's path prefix in a single statement.
+def move_subtree(item, target_list_id):
+    old_path = item.path
+    new_path = make_path(item.id)
+    total, completed = subtree_counts(item)
+
+    record_matching(item.list_id, subtree_filter(old_path), deleted=True)
+    add_counts_along(item.list_id, old_path, -total, -completed)
+    db.session.execute(
+        update(TodoItem)
+        .where(subtree_filter(old_path))
+        .values(
+            list_id=target_list_id,
+            path=literal(new_path, db.Text) + func.substr(TodoItem.path, len(old_path) + 1)
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+    item.list_id = target_list_id
+    item.parent_id = None
+    item.path = new_path
+    db.session.flush()
+    record_matching(target_list_id, subtree_filter(new_path))
+    add_counts(target_list_id, total, completed)
+
+# Set is_complete on an item and all of its descendants. The whole subtree is
+# flipped with one UPDATE without loading it; rows that already have the
+# requested status only get their completed counter set, and keep their
+# updated_at just like an unchanged ORM object would not have been flushed.
+# Every item in the subtree ends up with all or none of its descendants
+# complete, so its counter follows from its total.
+def complete_subtree(item, is_complete):
+    total, old_completed = subtree_counts(item)
+    new_completed = total if is_complete else 0
+
+    flipping = or_(TodoItem.is_complete != is_complete, TodoItem.is_complete.is_(None))
+    completed_count = TodoItem.total_count if is_complete else 0
+    changing = (
+        subtree_filter(item.path),
+        or_(flipping, TodoItem.completed_count != completed_count)
+    )
+
+    record_items(item.list_id, [item.id])
+    record_matching(item.list_id, *changing)
+    db.session.execute(
+        update(TodoItem)
+        .where(*changing)
+        .values(is_complete=is_complete, completed_count=completed_count,
+                updated_at=case((flipping, datetime.utcnow()), else_=TodoItem.updated_at))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.expire(item, ['is_complete', 'completed_count', 'updated_at'])
+    add_counts_along(item.list_id, item.path, 0, new_completed - old_completed)
+
+# Delete an item and all of its descendants with one DELETE
+def delete_subtree(item):
+    total, completed = subtree_counts(item)
+    record_matching(item.list_id, subtree_filter(item.path), deleted=True)
+    db.session.execute(
+        delete(TodoItem)
+        .where(subtree_filter(item.path))
+        .execution_options(synchronize_session=False)
+    )
+    add_counts_along(item.list_id, item.path, -total, -completed)
+    db.session.expunge(item)
+
+# Items of a list in id order. Children are always created after their
+# parent, so this also returns every parent before its children.
+def fetch_list_items(list_id):
+    return db.session.execute(
+        select(TodoItem.id, TodoItem.text, TodoItem.is_complete, TodoItem.parent_id,
+               TodoItem.total_count, TodoItem.completed_count)
+        .where(TodoItem.list_id == list_id)
+        .order_by(TodoItem.id)
+    ).all()
+
+def serialize_flat(rows):
+    return [{
+        'id': row.id,
+        'text': row.text,
+        'is_complete': row.is_complete,
+        'parent_id': row.parent_id,
+        'total_count': row.total_count,
+        'completed_count': row.completed_count
+    } for row in rows]
+
+# Assemble the nested structure in O(n). Rows are ordered by id, so siblings
+# keep the order the per-parent queries used to return them in.
+def build_tree(rows):
+    nodes = {}
+    for row in rows:
+        nodes[row.id] = {
+            'id': row.id,
+            'text': row.text,
+            'is_complete': row.is_complete,
+            'total_count': row.total_count,
+            'completed_count': row.completed_count,
+            'children': []
+        }
+
+    roots = []
+    for row in rows:
+        parent = nodes.get(row.parent_id)
+        if parent is None:
+            roots.append(nodes[row.id])
+        else:
+            parent['children'].append(nodes[row.id])
+
+    return roots
+
+# Recompute every path from parent_id. Moves used to re-list only the moved
+# item, so descendants also take over the list of their top-level ancestor,
+# which is the list they were displayed in. Items whose parent no longer
+# exists become top-level items.
+def rebuild_paths():
+    rows = db.session.execute(
+        select(TodoItem.id, TodoItem.parent_id, TodoItem.list_id)
+    ).all()
+
+    parents = {row.id: row.parent_id for row in rows}
+    lists = {row.id: row.list_id for row in rows}
+    resolved = {}
+
+    def resolve(item_id):
+        chain = []
+        while item_id not in resolved:
+            chain.append(item_id)
+            parent_id = parents[item_id]
+            if parent_id is None or parent_id not in parents:
+                resolved[item_id] = (make_path(item_id), lists[item_id], None)
+                chain.pop()
+                break
+            item_id = parent_id
+        for child_id in reversed(chain):
+            parent_id = parents[child_id]
+            parent_path, list_id, _ = resolved[parent_id]
+            resolved[child_id] = (make_path(child_id, parent_path), list_id, parent_id)
+
+    for row in rows:
+        resolve(row.id)
+
+    if resolved:
+        db.session.execute(update(TodoItem), [
+            {'id': item_id, 'path': path, 'list_id': list_id, 'parent_id': parent_id}
+            for item_id, (path, list_id, parent_id) in resolved.items()
+        ])
+    db.session.commit()
+
+# Recompute every progress counter from the paths and compare it with the
+# stored one. Returns the items and the lists whose counters are wrong, each
+# as a dict of id to the correct (total, completed) pair. With repair the
+# wrong counters are overwritten and recorded as changes; the caller commits.
+def check_counts(repair=False):
+    if repair:
+        begin_write()
+
+    rows = db.session.execute(
+        select(TodoItem.id, TodoItem.list_id, TodoItem.path, TodoItem.is_complete,
+               TodoItem.total_count, TodoItem.completed_count)
+    ).all()
+    lists = db.session.execute(
+        select(TodoList.id, TodoList.total_count, TodoList.completed_count)
+    ).all()
+
+    item_counts = {row.id: [0, 0] for row in rows}
+    list_counts = {row.id: [0, 0] for row in lists}
+    for row in rows:
+        done = 1 if row.is_complete else 0
+        counts = list_counts.get(row.list_id)
+        if counts is not None:
+            counts[0] += 1
+            counts[1] += done
+        for ancestor_id in ancestor_ids(row.path):
+            counts = item_counts.get(ancestor_id)
+            if counts is not None:
+                counts[0] += 1
+                counts[1] += done
+
+    wrong_items = {row.id: tuple(item_counts[row.id]) for row in rows
+                   if (row.total_count, row.completed_count) != tuple(item_counts[row.id])}
+    wrong_lists = {row.id: tuple(list_counts[row.id]) for row in lists
+                   if (row.total_count, row.completed_count) != tuple(list_counts[row.id])}
+
+    if repair:
+        if wrong_items:
+            table = TodoItem.__table__
+            db.session.execute(
+                update(table)
+                .where(table.c.id == bindparam('item_id'))
+                .values(total_count=bindparam('new_total'), completed_count=bindparam('new_completed'),
+                        updated_at=table.c.updated_at),
+                [{'item_id': item_id, 'new_total': total, 'new_completed': completed}
+                 for item_id, (total, completed) in wrong_items.items()]
+            )
+            changed = {}
+            for row in rows:
+                if row.id in wrong_items:
+                    changed.setdefault(row.list_id, []).append(row.id)
+            for list_id, item_ids in changed.items():
+                record_items(list_id, item_ids)
+
+        for list_id, (total, completed) in wrong_lists.items():
+            db.session.execute(
+                update(TodoList)
+                .where(TodoList.id == list_id)
+                .values(total_count=total, completed_count=completed)
+                .execution_options(synchronize_session=False)
+            )
+            current_revision(list_id)
+
+    return wrong_items, wrong_lists